@@ -0,0 +1,105 @@
+"""
+Measures the memory and time it takes to hydrate DM categories from their stored documents.
+
+Builds fake guilds whose channels, roles and members already exist, then loads every document with
+`DMCategory.from_dict` the same way a cache miss does. Only the memory allocated while hydrating is counted, the
+fake gateway state is allocated before measuring starts.
+
+Run from the repository root with `python -m benchmarks.dm_memory`.
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+import types
+
+from benchmarks.fake_discord import FakeGuild, FakeUser, RestRecorder
+from cogs.models.dm_objects import DMCategory
+
+CATEGORIES_PER_GUILD = 1000
+
+
+def build(categories, channels, permissions, seed=0):
+    """
+    Builds the fake guilds and one stored document per DM category.
+    """
+    rng = random.Random(seed)
+    rest = RestRecorder()
+    bot_user = FakeUser('FrogBot', id_=717467616700006482, bot=True)
+    guilds = {}
+    docs = []
+    for i in range(categories):
+        if i % CATEGORIES_PER_GUILD == 0:
+            guild = FakeGuild(f'Guild {len(guilds)}', rest, bot_user)
+            party_roles = [guild.add_role(f'Party {r}') for r in range(10)]
+            players = [guild.add_member(f'player-{len(guilds)}-{p}') for p in range(100)]
+            guilds[guild.id] = guild
+        owner = guild.add_member(f'dm-{i}')
+        category = guild.add_category(f"{owner.display_name}'s category")
+        doc_channels = []
+        for c in range(channels):
+            channel = guild.add_text_channel(f'dm-{i}-channel-{c}', category=category)
+            perms = []
+            for p in range(permissions):
+                if p % 2 == 0:
+                    perms.append({'type': 0, 'perm_type': rng.randrange(3), 'obj_id': rng.choice(party_roles).id})
+                else:
+                    perms.append({'type': 1, 'perm_type': rng.randrange(3), 'obj_id': rng.choice(players).id})
+            doc_channels.append({'channel_id': channel.id, 'permissions': perms})
+        docs.append({'owner_id': owner.id, 'category_id': category.id, 'guild_id': guild.id,
+                     'channels': doc_channels})
+    bot = types.SimpleNamespace(get_guild=guilds.get)
+    return bot, docs
+
+
+def hydrate(bot, docs):
+    return [DMCategory.from_dict(bot, doc) for doc in docs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--categories', type=int, default=10000)
+    parser.add_argument('--channels', type=int, default=5, help='Channels per DM category.')
+    parser.add_argument('--permissions', type=int, default=2, help='Stored permissions per channel.')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    args = parser.parse_args()
+
+    bot, docs = build(args.categories, args.channels, args.permissions)
+
+    # Time without tracing first, tracemalloc slows allocation down a lot
+    start = time.perf_counter()
+    hydrate(bot, docs)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    categories = hydrate(bot, docs)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    channel_count = sum(len(c.channels) for c in categories)
+    permission_count = sum(len(ch.permissions) for c in categories for ch in c.channels)
+    results = {
+        'benchmark': 'dm_memory',
+        'categories': len(categories),
+        'channels': channel_count,
+        'permissions': permission_count,
+        'bytes': used,
+        'bytes_per_category': round(used / len(categories)),
+        'hydrate_seconds': round(elapsed, 4),
+        'categories_per_sec': round(len(categories) / elapsed)
+    }
+    print(f'{len(categories)} categories, {channel_count} channels, {permission_count} permissions\n'
+          f'memory:  {used / 1024 / 1024:.2f} MiB ({results["bytes_per_category"]:,} bytes per category)\n'
+          f'hydrate: {results["hydrate_seconds"]} s ({results["categories_per_sec"]:,} categories/s)')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""
+Minimal fake gateway state for driving FrogBot without connecting to Discord.
+
+Only the attributes and methods that FrogBot and the discord.py converters touch are implemented. Anything that
+would be an HTTP request is counted by a shared `RestRecorder` instead, and can optionally be delayed to simulate
+latency.
+"""
+import asyncio
+import collections
+import itertools
+
+import discord
+
+_snowflakes = itertools.count(800000000000000000)
+
+
+def snowflake():
+    return next(_snowflakes)
+
+
+class RestRecorder:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = collections.Counter()
+
+    async def call(self, route):
+        self.calls[route] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def reset_calls(self):
+        self.calls.clear()
+
+
+class _FakeResponse:
+    status = 404
+    reason = 'Not Found'
+
+
+class FakeObject:
+    def __init__(self, id_=None):
+        self.id = id_ if id_ is not None else snowflake()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.id == other.id
+
+    def __hash__(self):
+        return self.id >> 22
+
+
+class FakeRole(FakeObject):
+    def __init__(self, guild, name, id_=None):
+        super().__init__(id_)
+        self.guild = guild
+        self.name = name
+        self.position = 0
+
+    @property
+    def mention(self):
+        return f'<@&{self.id}>'
+
+    def __str__(self):
+        return self.name
+
+
+class FakeUser(FakeObject):
+    def __init__(self, name, id_=None, bot=False):
+        super().__init__(id_)
+        self.name = name
+        self.display_name = name
+        self.discriminator = '0001'
+        self.bot = bot
+        self.avatar_url = 'https://cdn.discordapp.com/embed/avatars/0.png'
+
+    @property
+    def mention(self):
+        return f'<@{self.id}>'
+
+    def avatar_url_as(self, **kwargs):
+        return self.avatar_url
+
+    def __str__(self):
+        return f'{self.name}#{self.discriminator}'
+
+
+class FakeMember(FakeUser):
+    def __init__(self, guild, name, roles=(), id_=None, bot=False):
+        super().__init__(name, id_=id_, bot=bot)
+        self.guild = guild
+        self.roles = [guild.default_role, *roles]
+        self.guild_permissions = discord.Permissions.all()
+
+    async def add_roles(self, *roles, reason=None):
+        await self.guild.rest.call('member.add_roles')
+        self.roles.extend(r for r in roles if r not in self.roles)
+
+    async def remove_roles(self, *roles, reason=None):
+        await self.guild.rest.call('member.remove_roles')
+        self.roles = [r for r in self.roles if r not in roles]
+
+
+class FakeMessage(FakeObject):
+    def __init__(self, channel, author, content='', embed=None, id_=None):
+        super().__init__(id_)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embeds = [embed] if embed is not None else []
+        self.attachments = []
+        self.mentions = []
+        self.created_at = discord.utils.snowflake_time(self.id)
+        self.edited_at = None
+        self._state = None
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        await self.guild.rest.call('message.edit')
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embeds = [embed]
+
+    async def delete(self, delay=None):
+        await self.guild.rest.call('message.delete')
+        self.channel.messages.pop(self.id, None)
+
+    async def add_reaction(self, emoji):
+        await self.guild.rest.call('message.add_reaction')
+
+
+class _Messageable:
+    async def send(self, content=None, *, embed=None, file=None, delete_after=None, allowed_mentions=None):
+        await self.guild.rest.call('channel.send')
+        message = FakeMessage(self, self.guild.me, content or '', embed=embed)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.guild.rest.call('channel.fetch_message')
+        try:
+            return self.messages[message_id]
+        except KeyError:
+            raise discord.NotFound(_FakeResponse(), 'Unknown Message')
+
+
+class FakeTextChannel(_Messageable, discord.TextChannel):
+    # Subclasses the real TextChannel so the discord.py converters accept it
+    def __init__(self, guild, name, category=None, overwrites=None, topic=None, id_=None):
+        self.id = id_ if id_ is not None else snowflake()
+        self.guild = guild
+        self.name = name
+        self.topic = topic
+        self.position = 0
+        self.nsfw = False
+        self.slowmode_delay = 0
+        self.last_message_id = None
+        self._type = discord.ChannelType.text.value
+        self._state = None
+        self.category_id = category.id if category is not None else None
+        self._overwrites = dict(overwrites or {})
+        self.messages = {}
+
+    @property
+    def category(self):
+        return self.guild.get_channel(self.category_id)
+
+    @property
+    def overwrites(self):
+        return dict(self._overwrites)
+
+    async def edit(self, *, reason=None, **options):
+        await self.guild.rest.call('channel.edit')
+        if options.get('sync_permissions') and self.category is not None:
+            self._overwrites = dict(self.category.overwrites)
+        if 'overwrites' in options:
+            self._overwrites = dict(options['overwrites'])
+        for key in ('name', 'topic'):
+            if key in options:
+                setattr(self, key, options[key])
+
+    async def set_permissions(self, target, *, overwrite=None, reason=None):
+        await self.guild.rest.call('channel.set_permissions')
+        if overwrite is None:
+            self._overwrites.pop(target, None)
+        else:
+            self._overwrites[target] = overwrite
+
+    async def delete(self, *, reason=None):
+        await self.guild.rest.call('channel.delete')
+        self.guild.remove_channel(self)
+
+    async def delete_messages(self, messages):
+        await self.guild.rest.call('channel.delete_messages')
+        for message in messages:
+            self.messages.pop(message.id, None)
+
+    def __repr__(self):
+        return f'<FakeTextChannel id={self.id} name={self.name!r}>'
+
+
+class FakeCategoryChannel(FakeObject):
+    def __init__(self, guild, name, overwrites=None, id_=None):
+        super().__init__(id_)
+        self.guild = guild
+        self.name = name
+        self._overwrites = dict(overwrites or {})
+
+    @property
+    def overwrites(self):
+        return dict(self._overwrites)
+
+    @property
+    def channels(self):
+        return [c for c in self.guild.text_channels if c.category_id == self.id]
+
+    async def create_text_channel(self, name, **options):
+        return await self.guild.create_text_channel(name, category=self, **options)
+
+    async def delete(self, *, reason=None):
+        await self.guild.rest.call('channel.delete')
+        self.guild.remove_channel(self)
+
+
+class FakeGuild(FakeObject):
+    def __init__(self, name, rest: RestRecorder, bot_user, id_=None):
+        super().__init__(id_)
+        self.name = name
+        self.rest = rest
+        self.default_role = FakeRole(self, '@everyone', id_=self.id)
+        self._roles = {self.default_role.id: self.default_role}
+        self._members = {}
+        self._channels = {}
+        self.me = self.add_member(bot_user.name, id_=bot_user.id, bot=True)
+        self.owner = self.me
+
+    # ---- Setup helpers (no REST) ----
+    def add_role(self, name):
+        role = FakeRole(self, name)
+        self._roles[role.id] = role
+        return role
+
+    def add_member(self, name, roles=(), id_=None, bot=False):
+        member = FakeMember(self, name, roles=roles, id_=id_, bot=bot)
+        self._members[member.id] = member
+        return member
+
+    def add_category(self, name, overwrites=None):
+        category = FakeCategoryChannel(self, name, overwrites=overwrites)
+        self._channels[category.id] = category
+        return category
+
+    def add_text_channel(self, name, category=None, overwrites=None, topic=None):
+        channel = FakeTextChannel(self, name, category=category, overwrites=overwrites, topic=topic)
+        self._channels[channel.id] = channel
+        return channel
+
+    def remove_channel(self, channel):
+        self._channels.pop(channel.id, None)
+
+    # ---- discord.Guild API ----
+    @property
+    def roles(self):
+        return list(self._roles.values())
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def member_count(self):
+        return len(self._members)
+
+    @property
+    def channels(self):
+        return list(self._channels.values())
+
+    @property
+    def text_channels(self):
+        return [c for c in self._channels.values() if isinstance(c, FakeTextChannel)]
+
+    @property
+    def categories(self):
+        return [c for c in self._channels.values() if isinstance(c, FakeCategoryChannel)]
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    async def create_category(self, name, *, overwrites=None, reason=None, position=None):
+        await self.rest.call('guild.create_channel')
+        return self.add_category(name, overwrites=overwrites)
+
+    async def create_text_channel(self, name, *, overwrites=None, category=None, reason=None, **options):
+        await self.rest.call('guild.create_channel')
+        if overwrites is None and category is not None:
+            overwrites = category.overwrites
+        return self.add_text_channel(name, category=category, overwrites=overwrites, topic=options.get('topic'))
+
+    def __str__(self):
+        return self.name
+
+
+class FakeReactionPayload:
+    def __init__(self, guild, member, message_id, channel_id, emoji='\N{WHITE HEAVY CHECK MARK}', add=True):
+        self.guild_id = guild.id
+        self.user_id = member.id
+        # discord.py only fills in member for reaction adds
+        self.member = member if add else None
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.emoji = emoji
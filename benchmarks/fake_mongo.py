@@ -0,0 +1,262 @@
+"""
+In-process stand-in for the parts of the motor API that FrogBot uses.
+
+Documents are deep-copied in and out so callers cannot mutate stored data, the same as a round-trip through
+BSON. Like motor, every method returns a Future that runs even if it is never awaited. Every call is counted per
+collection and operation, and can optionally be delayed to simulate network latency.
+"""
+import asyncio
+import collections
+import copy
+import functools
+import itertools
+
+_ids = itertools.count(1)
+
+
+def _get(doc, path):
+    for part in path.split('.'):
+        if isinstance(doc, list) and part.isdigit():
+            if int(part) >= len(doc):
+                return None, False
+            doc = doc[int(part)]
+            continue
+        if isinstance(doc, list):
+            # Like Mongo, a path through an array matches the field in each element
+            doc = [item[part] for item in doc if isinstance(item, dict) and part in item]
+            continue
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+def _compare(value, op, target):
+    if op == '$eq':
+        return value == target
+    if op == '$ne':
+        return value != target
+    if op == '$in':
+        return value in target
+    if op == '$nin':
+        return value not in target
+    if value is None:
+        return False
+    if op == '$lt':
+        return value < target
+    if op == '$lte':
+        return value <= target
+    if op == '$gt':
+        return value > target
+    if op == '$gte':
+        return value >= target
+    raise NotImplementedError(f'Operator {op} is not supported by the fake.')
+
+
+def matches(doc, query) -> bool:
+    for key, condition in (query or {}).items():
+        if key == '$or':
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+            continue
+        value, exists = _get(doc, key)
+        if isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+            for op, target in condition.items():
+                if op == '$exists':
+                    if exists != bool(target):
+                        return False
+                elif isinstance(value, list) and op in ('$eq', '$in'):
+                    if not any(_compare(v, op, target) for v in value):
+                        return False
+                elif isinstance(value, list) and op in ('$ne', '$nin'):
+                    if not all(_compare(v, op, target) for v in value):
+                        return False
+                elif not _compare(value, op, target):
+                    return False
+        elif isinstance(value, list) and not isinstance(condition, list):
+            if condition not in value:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return doc
+    include = {k for k, v in projection.items() if v}
+    if not include:
+        return {k: v for k, v in doc.items() if k not in projection}
+    out = {k: v for k, v in doc.items() if k in include}
+    if projection.get('_id', 1) and '_id' in doc:
+        out['_id'] = doc['_id']
+    return out
+
+
+def apply_update(doc, update):
+    for op, fields in update.items():
+        for key, value in fields.items():
+            if op == '$set':
+                doc[key] = copy.deepcopy(value)
+            elif op == '$unset':
+                doc.pop(key, None)
+            elif op == '$inc':
+                doc[key] = doc.get(key, 0) + value
+            elif op == '$push':
+                doc.setdefault(key, []).append(copy.deepcopy(value))
+            elif op == '$addToSet':
+                existing = doc.setdefault(key, [])
+                if value not in existing:
+                    existing.append(copy.deepcopy(value))
+            elif op == '$pull':
+                if isinstance(value, dict):
+                    doc[key] = [x for x in doc.get(key, []) if not (isinstance(x, dict) and matches(x, value))]
+                else:
+                    doc[key] = [x for x in doc.get(key, []) if x != value]
+            else:
+                raise NotImplementedError(f'Update operator {op} is not supported by the fake.')
+
+
+def motor_method(func):
+    """
+    Motor methods return a Future that runs even if it is never awaited, so do the same here.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return asyncio.ensure_future(func(*args, **kwargs))
+    return wrapper
+
+
+class Result:
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def __aiter__(self):
+        self._iter = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        return list(self._docs if length is None else self._docs[:length])
+
+
+class FakeCollection:
+    def __init__(self, name, database):
+        self.name = name
+        self.database = database
+        self.docs = []
+
+    async def _call(self, op):
+        self.database.calls[f'{self.name}.{op}'] += 1
+        if self.database.latency:
+            await asyncio.sleep(self.database.latency)
+
+    def _find(self, query):
+        return [doc for doc in self.docs if matches(doc, query)]
+
+    @motor_method
+    async def find_one(self, query=None, projection=None):
+        await self._call('find_one')
+        found = self._find(query)
+        return copy.deepcopy(project(found[0], projection)) if found else None
+
+    def find(self, query=None, projection=None):
+        # The query runs when the cursor is first iterated, but it is one round-trip either way
+        self.database.calls[f'{self.name}.find'] += 1
+        return FakeCursor([copy.deepcopy(project(doc, projection)) for doc in self._find(query)])
+
+    @motor_method
+    async def insert_one(self, doc):
+        await self._call('insert_one')
+        doc = copy.deepcopy(doc)
+        doc.setdefault('_id', next(_ids))
+        self.docs.append(doc)
+        return Result(inserted_id=doc['_id'])
+
+    def _upsert(self, query, update):
+        doc = {k: v for k, v in query.items() if not k.startswith('$') and not isinstance(v, dict)}
+        doc.setdefault('_id', next(_ids))
+        apply_update(doc, update)
+        self.docs.append(doc)
+        return doc
+
+    @motor_method
+    async def update_one(self, query, update, upsert=False):
+        await self._call('update_one')
+        found = self._find(query)
+        if found:
+            apply_update(found[0], update)
+            return Result(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = self._upsert(query, update)
+            return Result(matched_count=0, modified_count=0, upserted_id=doc['_id'])
+        return Result(matched_count=0, modified_count=0, upserted_id=None)
+
+    @motor_method
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=False):
+        await self._call('find_one_and_update')
+        found = self._find(query)
+        if not found:
+            if not upsert:
+                return None
+            doc = self._upsert(query, update)
+            return copy.deepcopy(project(doc, projection)) if return_document else None
+        # pymongo's ReturnDocument.BEFORE is False and AFTER is True
+        before = copy.deepcopy(project(found[0], projection))
+        apply_update(found[0], update)
+        return copy.deepcopy(project(found[0], projection)) if return_document else before
+
+    @motor_method
+    async def delete_one(self, query):
+        await self._call('delete_one')
+        found = self._find(query)
+        if found:
+            self.docs.remove(found[0])
+        return Result(deleted_count=len(found[:1]))
+
+    @motor_method
+    async def delete_many(self, query):
+        await self._call('delete_many')
+        found = self._find(query)
+        for doc in found:
+            self.docs.remove(doc)
+        return Result(deleted_count=len(found))
+
+    def seed(self, docs):
+        """
+        Inserts documents without counting a call.
+        """
+        for doc in docs:
+            doc = copy.deepcopy(doc)
+            doc.setdefault('_id', next(_ids))
+            self.docs.append(doc)
+
+
+class FakeDatabase:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def reset_calls(self):
+        self.calls.clear()
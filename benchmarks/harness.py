@@ -0,0 +1,169 @@
+"""
+Builds the global FrogBot from `dbot.py` against fake Discord state and the fake Mongo database.
+"""
+import asyncio
+import random
+
+import discord
+
+from benchmarks.fake_discord import FakeGuild, FakeUser, FakeMessage, RestRecorder
+from benchmarks.fake_mongo import FakeDatabase
+from utils.context import Context as CustomContext
+
+
+class BenchContext(CustomContext):
+    # Context.send goes through the HTTP client, route it to the fake channel instead
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class World:
+    def __init__(self, guilds: int = 5, members_per_guild: int = 50, dms_per_guild: int = 5,
+                 channels_per_dm: int = 10, sheets: int = 20, custom_commands: int = 10,
+                 rest_latency: float = 0.0, db_latency: float = 0.0, seed: int = 0):
+        """
+        Fake Discord and Mongo state for the benchmarks.
+
+        The first guild is the bot's personal server, with a sheet channel, general channel and pending sheets.
+        Each guild has `dms_per_guild` DMs, each with a DM category of `channels_per_dm` channels that already
+        have a few stored permissions.
+        """
+        import dbot
+
+        self.dbot = dbot
+        self.bot = dbot.bot
+        self.rng = random.Random(seed)
+        self.rest = RestRecorder(latency=rest_latency)
+        self.db = FakeDatabase(latency=db_latency)
+        self.bot_user = FakeUser('FrogBot', id_=717467616700006482, bot=True)
+        self.guilds = []
+        self.dms = []
+        self.players = []
+        self.sheets = []
+        self.general_channels = []
+
+        self._build(guilds, members_per_guild, dms_per_guild, channels_per_dm, sheets, custom_commands)
+        self._attach()
+
+    def _build(self, guilds, members_per_guild, dms_per_guild, channels_per_dm, sheets, custom_commands):
+        from cogs.models.dm_objects import DMCategory, DMChannel, DMPermissions
+
+        for g in range(guilds):
+            guild = FakeGuild(f'Guild {g}', self.rest, self.bot_user)
+            dm_role = guild.add_role('DM')
+            player_role = guild.add_role('Player')
+            guild.add_role('Commoner')
+            party_roles = [guild.add_role(f'Party {i}') for i in range(4)]
+            general = guild.add_text_channel('general')
+            self.general_channels.append(general)
+            players = [guild.add_member(f'player-{g}-{i}', roles=[player_role]) for i in range(members_per_guild)]
+            self.players.extend((guild, general, p) for p in players)
+
+            for d in range(dms_per_guild):
+                owner = guild.add_member(f'dm-{g}-{d}', roles=[dm_role])
+                category = guild.add_category(f"{owner.display_name}'s category")
+                dm_category = DMCategory(owner=owner, category=category, guild=guild, channels=[])
+                for c in range(channels_per_dm):
+                    channel = guild.add_text_channel(f'dm-{d}-channel-{c}', category=category)
+                    permissions = [DMPermissions(type_=0, obj=self.rng.choice(party_roles), perm_type=1, guild=guild),
+                                   DMPermissions(type_=1, obj=self.rng.choice(players), perm_type=2, guild=guild)]
+                    dm_category.add_channel(DMChannel(dm_category, permissions, channel))
+                self.db['dmcategories'].seed([dm_category.to_dict()])
+                self.dms.append((guild, owner, dm_category, party_roles))
+
+            self.db['custom_commands'].seed(
+                [{'owner_id': guild.owner.id, 'guild_id': guild.id, 'name': f'cc{i}', 'content': f'Custom {i}'}
+                 for i in range(custom_commands)]
+            )
+            self.guilds.append(guild)
+
+        # Personal server setup for sheet approval
+        personal = self.guilds[0]
+        self.personal = personal
+        self.sheet_channel = personal.add_text_channel('character-submission')
+        self.general_channel = self.general_channels[0]
+        approver_role = personal.add_role('Lord of the Sheet')
+        self.approvers = [personal.add_member(f'sheet-lord-{i}', roles=[approver_role]) for i in range(4)]
+        self.chat_messages = [FakeMessage(self.general_channel, self.players[0][2], 'hello') for _ in range(50)]
+        for message in self.chat_messages:
+            self.general_channel.messages[message.id] = message
+        for i in range(sheets):
+            self.sheets.append(self.add_sheet(self.players[i % len(self.players)][2]))
+
+    def add_sheet(self, owner):
+        """
+        Posts a sheet waiting for approval in the personal server, without counting any calls.
+        """
+        embed = discord.Embed(title=f'Sheet Approval - {owner.display_name}',
+                              description=f'https://ddb.ac/characters/{owner.id}')
+        message = FakeMessage(self.sheet_channel, self.personal.me, embed=embed)
+        self.sheet_channel.messages[message.id] = message
+        self.db['to_approve'].seed([{'message_id': message.id, 'approvals': [],
+                                     'channel_id': self.sheet_channel.id, 'owner_id': owner.id}])
+        sheet_cog = self.bot.get_cog('SheetApproval')
+        if sheet_cog is not None:
+            # Same as the sheet command, which remembers the message it sent
+            sheet_cog.pending.add(message.id)
+            sheet_cog.messages.put(message)
+        return message
+
+    def _attach(self):
+        bot = self.bot
+        bot.mdb = self.db
+        for cog in bot.cogs.values():
+            db = getattr(cog, 'db', None)
+            if db is not None and hasattr(db, 'name'):
+                cog.db = self.db[db.name]
+        bot._connection.user = self.bot_user
+        for guild in self.guilds:
+            bot._connection._guilds[guild.id] = guild
+        bot.personal_server.update({
+            'server_id': self.personal.id,
+            'sheet_channel': self.sheet_channel.id,
+            'general_channel': self.general_channel.id
+        })
+        bot.get_context = self._get_context
+        # Background loops would keep drain() waiting and add their calls to the first scenario
+        bot.get_cog('DMCommands').reconcile_permissions.cancel()
+        bot.get_cog('DMCommands').resume_deletes.cancel()
+
+    async def _get_context(self, message, *, cls=BenchContext):
+        return await type(self.bot).get_context(self.bot, message, cls=cls)
+
+    async def start(self):
+        bot = self.bot
+        await bot.preload()
+        bot.scheduler.start(bot.loop)
+        # Like the deletion queue, DM categories are flushed by the benchmarks instead of on an interval
+        bot.dm_categories.db = self.db['dmcategories']
+        bot._ready.set()
+
+    async def close(self):
+        self.bot.scheduler.stop()
+        await self.bot.dm_categories.stop()
+        for cog in self.bot.cogs.values():
+            session = getattr(cog, '_session', None)
+            if session is not None:
+                await session.close()
+
+    async def drain(self):
+        """
+        Waits until every queued command and every event handler it dispatched has finished.
+
+        Sheet embed edits still waiting for their update window are not waited for, the scenario flushes them.
+        """
+        current = asyncio.current_task()
+        workers = set(self.bot.scheduler._workers)
+        sheet_cog = self.bot.get_cog('SheetApproval')
+        while True:
+            await asyncio.sleep(0)
+            skip = workers | {entry[-1] for entry in sheet_cog._updates.values()} if sheet_cog is not None else workers
+            pending = [t for t in asyncio.all_tasks() if t is not current and t not in skip and not t.done()]
+            if not pending and self.bot.scheduler.queued == 0 and self.bot.scheduler.running == 0:
+                return
+            if pending:
+                await asyncio.wait(pending)
+
+    def reset_counters(self):
+        self.rest.reset_calls()
+        self.db.reset_calls()
@@ -0,0 +1,141 @@
+"""
+Measures how many messages per second the prefix stage of `on_message` can handle.
+
+Both paths run against the real bot from `dbot.py`, built by the benchmark harness. `before` mirrors the old path:
+every message goes through `Bot.get_context`, with the old `get_prefix` that built a fresh `when_mentioned_or` list.
+`after` is the current path: `FrogBot.could_be_command` rejects chat with one `str.startswith`, and only possible
+commands go on to `Bot.get_context`.
+
+Run from the repository root with `python -m benchmarks.prefix_filter`.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from discord.ext import commands
+
+from benchmarks.fake_discord import FakeMessage
+
+CUSTOM_PREFIX = '!'
+
+PROSE = (
+    'The rogue slips through the shadows toward the gate.',
+    '*rolls a perception check* 14',
+    'Does anyone have a spare healing potion?',
+    '(OOC: I will be away this weekend)',
+    'I cast fireball at the goblins!',
+    'What does the inscription on the door say?',
+)
+COMMANDS = ('dm', 'ping', 'sheet https://ddb.ac/characters/1', 'roll 1d20', 'cc list')
+
+
+def build_messages(world, count):
+    """
+    Builds a mix of roughly 90% chat, 8% prefixed commands and 2% mention commands.
+    """
+    rng = world.rng
+    messages = []
+    for _ in range(count):
+        guild, general, author = rng.choice(world.players)
+        roll = rng.random()
+        if roll < 0.90:
+            content = rng.choice(PROSE)
+        elif roll < 0.98:
+            content = world.bot.prefixes.get(guild.id) + rng.choice(COMMANDS)
+        else:
+            content = f'<@!{world.bot_user.id}> ' + rng.choice(COMMANDS)
+        messages.append(FakeMessage(general, author, content))
+    return messages
+
+
+async def old_get_prefix(client, message):
+    if not message.guild:
+        return commands.when_mentioned_or(client.prefixes.default)(client, message)
+    prefix = client.prefixes.get(message.guild.id)
+    return commands.when_mentioned_or(prefix)(client, message)
+
+
+async def run_before(bot, messages):
+    matched = 0
+    for message in messages:
+        ctx = await bot.get_context(message)
+        if ctx.prefix is not None:
+            matched += 1
+    return matched
+
+
+async def run_after(bot, messages):
+    matched = 0
+    for message in messages:
+        if not bot.could_be_command(message):
+            continue
+        ctx = await bot.get_context(message)
+        if ctx.prefix is not None:
+            matched += 1
+    return matched
+
+
+async def measure(func, bot, messages, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await func(bot, messages)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(messages) / best, result
+
+
+async def run(args):
+    from benchmarks.harness import World
+
+    world = World(guilds=args.guilds)
+    await world.start()
+    bot = world.bot
+    # A custom prefix in the first guild, the rest use the default
+    bot.prefixes.set(world.guilds[0].id, CUSTOM_PREFIX)
+    messages = build_messages(world, args.messages)
+
+    new_get_prefix = bot.command_prefix
+    bot.command_prefix = old_get_prefix
+    try:
+        before, before_matched = await measure(run_before, bot, messages, args.repeat)
+    finally:
+        bot.command_prefix = new_get_prefix
+    after, after_matched = await measure(run_after, bot, messages, args.repeat)
+    await world.close()
+    assert before_matched == after_matched, 'Matchers disagree.'
+    return before, after, after_matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    args = parser.parse_args()
+
+    # dbot builds the bot on import, so the harness has to be created inside the running loop
+    before, after, matched = asyncio.run(run(args))
+
+    results = {
+        'benchmark': 'prefix_filter',
+        'messages': args.messages,
+        'candidates': matched,
+        'before_msgs_per_sec': round(before),
+        'after_msgs_per_sec': round(after),
+        'speedup': round(after / before, 2)
+    }
+    print(f'{args.messages} messages, {matched} possible commands\n'
+          f'before: {results["before_msgs_per_sec"]:>12,} msg/s\n'
+          f'after:  {results["after_msgs_per_sec"]:>12,} msg/s\n'
+          f'speedup: {results["speedup"]}x')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
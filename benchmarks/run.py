@@ -0,0 +1,289 @@
+"""
+Offline benchmark suite for FrogBot.
+
+Drives the real `dbot.py` event handlers against fake Discord state and an in-process Mongo stand-in, and reports
+throughput, latency percentiles, database calls and REST calls for each scenario. Results are written as JSON so
+runs can be compared across commits.
+
+Run from the repository root with `python -m benchmarks.run`. Needs the packages in requirements.txt, but no
+Discord token or Mongo server.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import subprocess
+import time
+import types
+
+from benchmarks.fake_discord import FakeMessage, FakeReactionPayload
+
+PROSE = (
+    'The rogue slips through the shadows toward the gate.',
+    '*rolls a perception check* 14',
+    'Does anyone have a spare healing potion?',
+    '(OOC: I will be away this weekend)',
+    'I cast fireball at the goblins!',
+)
+
+
+def summarize(latencies):
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': pct(50),
+        'p95_ms': pct(95),
+        'p99_ms': pct(99),
+        'max_ms': round(ordered[-1] * 1000, 3)
+    }
+
+
+class Recorder:
+    def __init__(self, world):
+        self.world = world
+        self.latencies = []
+        self.started = None
+
+    async def __aenter__(self):
+        self.world.reset_counters()
+        self.started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exc):
+        # Invocation messages are deleted, DM categories written and sheet embeds edited in batches, include them in
+        # this scenario
+        await self.world.bot.deletion_queue.flush()
+        await self.world.bot.dm_categories.flush()
+        await self.world.bot.get_cog('SheetApproval').flush_updates()
+        self.elapsed = time.perf_counter() - self.started
+
+    async def time(self, coro):
+        start = time.perf_counter()
+        await coro
+        await self.world.drain()
+        self.latencies.append(time.perf_counter() - start)
+
+    def result(self, **extra):
+        ops = len(self.latencies)
+        out = {
+            'operations': ops,
+            'seconds': round(self.elapsed, 4),
+            'ops_per_sec': round(ops / self.elapsed, 1) if self.elapsed else None,
+            'latency': summarize(self.latencies),
+            'db_calls': dict(sorted(self.world.db.calls.items())),
+            'rest_calls': dict(sorted(self.world.rest.calls.items())),
+            'db_calls_per_op': round(sum(self.world.db.calls.values()) / ops, 3) if ops else 0,
+            'rest_calls_per_op': round(sum(self.world.rest.calls.values()) / ops, 3) if ops else 0
+        }
+        out.update(extra)
+        return out
+
+
+async def bench_on_message(world, count):
+    """
+    A realistic play-by-post mix: mostly chat, some custom commands and a few real commands.
+    """
+    rng = world.rng
+    dm_channels = {owner.id: dm_cat.channels[0].channel for _, owner, dm_cat, _ in world.dms}
+    messages = []
+    for _ in range(count):
+        roll = rng.random()
+        guild, general, author = rng.choice(world.players)
+        if roll < 0.88:
+            content = rng.choice(PROSE)
+        elif roll < 0.94:
+            content = f';cc{rng.randrange(10)}'
+        elif roll < 0.98:
+            content = ';choice sword axe bow'
+        else:
+            guild, author, _, _ = rng.choice(world.dms)
+            general = world.general_channels[world.guilds.index(guild)]
+            content = f';dm list <#{dm_channels[author.id].id}>'
+        messages.append(FakeMessage(general, author, content))
+
+    async with Recorder(world) as rec:
+        for message in messages:
+            await rec.time(world.dbot.on_message(message))
+    return rec.result()
+
+
+async def bench_sheet_reactions(world, count):
+    """
+    Reactions in the personal server: most on ordinary chat, the rest adding and removing sheet approvals.
+    """
+    rng = world.rng
+    cog = world.bot.get_cog('SheetApproval')
+    events = []
+    for _ in range(count):
+        approver = rng.choice(world.approvers)
+        if rng.random() < 0.8:
+            message = rng.choice(world.chat_messages)
+            events.append((cog.check_for_approval, FakeReactionPayload(world.personal, approver, message.id,
+                                                                        message.channel.id)))
+        else:
+            message = rng.choice(world.sheets)
+            add = rng.random() < 0.6
+            handler = cog.check_for_approval if add else cog.check_for_deny
+            events.append((handler, FakeReactionPayload(world.personal, approver, message.id,
+                                                        message.channel.id, add=add)))
+
+    async with Recorder(world) as rec:
+        for handler, payload in events:
+            await rec.time(handler(payload))
+    return rec.result()
+
+
+async def bench_sheet_stress(world, count):
+    """
+    Every approver reacts to each of `count` new sheets at the same time, with database latency so the handlers
+    interleave. Checks that every sheet ends up with exactly two approvals and is announced exactly once.
+    """
+    cog = world.bot.get_cog('SheetApproval')
+    sheets = [world.add_sheet(world.players[i % len(world.players)][2]) for i in range(count)]
+    events = [FakeReactionPayload(world.personal, approver, sheet.id, sheet.channel.id)
+              for sheet in sheets for approver in world.approvers]
+    announced_before = len(world.general_channel.messages)
+    latency, world.db.latency = world.db.latency, max(world.db.latency, 0.001)
+
+    async def timed(rec, payload):
+        start = time.perf_counter()
+        await cog.check_for_approval(payload)
+        rec.latencies.append(time.perf_counter() - start)
+
+    async with Recorder(world) as rec:
+        await asyncio.gather(*[timed(rec, payload) for payload in events])
+        await world.drain()
+    world.db.latency = latency
+
+    stored = {doc['message_id']: doc['approvals'] for doc in world.db['to_approve'].docs}
+    return rec.result(
+        sheets=count,
+        lost_updates=sum(max(0, 2 - len(stored[sheet.id])) for sheet in sheets),
+        extra_approvals=sum(max(0, len(stored[sheet.id]) - 2) for sheet in sheets),
+        announcements=len(world.general_channel.messages) - announced_before
+    )
+
+
+DM_COMMANDS = (
+    ('dm', '{prefix}dm'),
+    ('dm list', '{prefix}dm list <#{channel}>'),
+    ('dm addrole', '{prefix}dm addrole <#{channel}> <@&{role}> 1'),
+    ('dm removerole', '{prefix}dm removerole <#{channel}> <@&{role}>'),
+    ('dm addrole-all', '{prefix}dm addrole-all <@&{role}> 2'),
+    ('dm removerole-all', '{prefix}dm removerole-all <@&{role}>'),
+    ('dm archive', '{prefix}dm archive <#{channel}>'),
+    ('dm unarchive', '{prefix}dm unarchive <#{channel}>'),
+    ('dm update', '{prefix}dm update'),
+)
+
+
+async def bench_dm_commands(world, rounds):
+    """
+    Runs every `dm` subcommand for each DM, recording calls per subcommand.
+    """
+    dm_base = world.bot.get_command('dm')
+    per_command = {}
+    async with Recorder(world) as rec:
+        for _ in range(rounds):
+            for guild, owner, dm_cat, party_roles in world.dms:
+                general = world.general_channels[world.guilds.index(guild)]
+                fmt = {'prefix': ';', 'channel': world.rng.choice(dm_cat.channels).channel.id,
+                       'role': world.rng.choice(party_roles).id}
+                for name, template in DM_COMMANDS:
+                    message = FakeMessage(general, owner, template.format(**fmt))
+                    db_before, rest_before = sum(world.db.calls.values()), sum(world.rest.calls.values())
+                    await rec.time(world.dbot.on_message(message))
+                    stats = per_command.setdefault(name, {'latencies': [], 'db_calls': 0, 'rest_calls': 0})
+                    stats['latencies'].append(rec.latencies[-1])
+                    stats['db_calls'] += sum(world.db.calls.values()) - db_before
+                    stats['rest_calls'] += sum(world.rest.calls.values()) - rest_before
+                    # The base dm command has a per-user cooldown, don't let it turn into error replies
+                    dm_base.reset_cooldown(types.SimpleNamespace(message=message))
+    commands = {
+        name: {
+            'latency': summarize(stats['latencies']),
+            'db_calls_per_op': round(stats['db_calls'] / len(stats['latencies']), 3),
+            'rest_calls_per_op': round(stats['rest_calls'] / len(stats['latencies']), 3)
+        } for name, stats in per_command.items()
+    }
+    return rec.result(commands=commands)
+
+
+SCENARIOS = {
+    'on_message': (bench_on_message, 'messages'),
+    'sheet_reactions': (bench_sheet_reactions, 'reactions'),
+    'sheet_stress': (bench_sheet_stress, 'stress_sheets'),
+    'dm_commands': (bench_dm_commands, 'dm_rounds'),
+}
+
+
+def git_commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    from benchmarks.harness import World
+
+    world = World(guilds=args.guilds, dms_per_guild=args.dms, channels_per_dm=args.channels,
+                  rest_latency=args.rest_latency / 1000, db_latency=args.db_latency / 1000, seed=args.seed)
+    await world.start()
+    results = {}
+    for name in args.scenarios:
+        func, size_arg = SCENARIOS[name]
+        results[name] = await func(world, getattr(args, size_arg))
+        print(f'{name}: {results[name]["ops_per_sec"]} ops/s, p95 {results[name]["latency"].get("p95_ms")} ms, '
+              f'{results[name]["db_calls_per_op"]} db calls/op, {results[name]["rest_calls_per_op"]} REST calls/op')
+        if 'lost_updates' in results[name]:
+            print(f'{name}: {results[name]["lost_updates"]} lost updates, {results[name]["extra_approvals"]} extra '
+                  f'approvals, {results[name]["announcements"]} announcements for {results[name]["sheets"]} sheets')
+    await world.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', help=f'Scenarios to run, any of {", ".join(SCENARIOS)} '
+                                                     f'(default: all).')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--reactions', type=int, default=1000)
+    parser.add_argument('--stress-sheets', type=int, default=50)
+    parser.add_argument('--dm-rounds', type=int, default=3)
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--dms', type=int, default=5, help='DM categories per guild.')
+    parser.add_argument('--channels', type=int, default=10, help='Channels per DM category.')
+    parser.add_argument('--rest-latency', type=float, default=0.0, help='Simulated REST latency in ms.')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='Simulated database latency in ms.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json', help='Where to write the JSON results.')
+    args = parser.parse_args()
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'Unknown scenario(s): {", ".join(unknown)}')
+
+    # dbot builds the bot (and the cogs' aiohttp sessions) on import, so import it inside the running loop
+    results = asyncio.run(run(args))
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'scenarios': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,33 @@ API_KEY = os.getenv('BOT_API_KEY', None)
 DBL_API_KEY = os.getenv('BOT_DBL_API_KEY', None)
 DAGPI_API_KEY = os.getenv('BOT_DAGPI_API_KEY', None)
 
+# Command Scheduling
+COMMAND_CONCURRENCY = int(os.getenv('COMMAND_CONCURRENCY', '16'))
+GUILD_CONCURRENCY = int(os.getenv('GUILD_CONCURRENCY', '4'))
+GUILD_QUEUE_SIZE = int(os.getenv('GUILD_QUEUE_SIZE', '10'))
+MAX_QUEUED_COMMANDS = int(os.getenv('MAX_QUEUED_COMMANDS', '200'))
+
+# Invocation Message Deletion
+DELETE_FLUSH_INTERVAL = float(os.getenv('DELETE_FLUSH_INTERVAL', '2'))
+DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', '100'))
+
+# DM Categories
+DM_SYNC_CONCURRENCY = int(os.getenv('DM_SYNC_CONCURRENCY', '5'))
+DM_CACHE_SIZE = int(os.getenv('DM_CACHE_SIZE', '500'))
+DM_FLUSH_INTERVAL = float(os.getenv('DM_FLUSH_INTERVAL', '10'))
+DM_RECONCILE_INTERVAL = float(os.getenv('DM_RECONCILE_INTERVAL', '30'))
+DM_RECONCILE_BUDGET = float(os.getenv('DM_RECONCILE_BUDGET', '10'))
+
+# Sheet Approval
+SHEET_CACHE_SIZE = int(os.getenv('SHEET_CACHE_SIZE', '200'))
+SHEET_UPDATE_DELAY = float(os.getenv('SHEET_UPDATE_DELAY', '2'))
+
+# Load dev tooling (jishaku) on first use instead of at startup
+LAZY_COGS = os.getenv('LAZY_COGS', 'true').lower() in ('true', 't', 'yes', 'y', '1')
+
+# Extra startup checks, such as warning about database queries that scan a whole collection
+DEBUG = os.getenv('DEBUG', 'false').lower() in ('true', 't', 'yes', 'y', '1')
+
 # Version
 VERSION = os.getenv('VERSION', 'testing')
 
@@ -78,19 +78,35 @@ class CustomCommands(commands.Cog, name='CustomCommands'):
     def __init__(self, bot):
         self.bot = bot
         self.db = bot.mdb['custom_commands']
+        # guild_id -> {name: content}
+        self.index = {}
+        if bot.is_ready():
+            bot.loop.create_task(self.preload())
 
     async def cog_check(self, ctx):
         return ctx.guild is not None
 
+    async def preload(self):
+        """
+        Loads every custom command into the in-memory index.
+        """
+        index = {}
+        async for cc in self.db.find({}, {'_id': 0, 'guild_id': 1, 'name': 1, 'content': 1}):
+            index.setdefault(cc['guild_id'], {})[cc['name']] = cc['content']
+        self.index = index
+        log.info(f'Loaded {sum(len(x) for x in index.values())} custom commands for {len(index)} guilds.')
+
     async def run_custom_commands(self, ctx):
-        if ctx.guild is None:
+        if ctx.guild is None or ctx.invoked_with is None:
             return
 
-        cc = await self.db.find_one({'guild_id': ctx.guild_id, 'name': ctx.invoked_with})
-        if cc is None:
+        guild_commands = self.index.get(ctx.guild_id)
+        if not guild_commands:
+            return
+        content = guild_commands.get(ctx.invoked_with)
+        if content is None:
             return
-        cc = CustomCommand.from_dict(cc)
-        return await ctx.send(cc.content)
+        return await ctx.send(content)
 
     @commands.group(name='cc', invoke_without_command=True)
     async def cc_base(self, ctx):
@@ -117,6 +133,7 @@ class CustomCommands(commands.Cog, name='CustomCommands'):
                                              content=content)
         except InvalidArgument as e:
             return await ctx.send(f'Encountered an error while creating the command:\n{str(e)}')
+        self.index.setdefault(new_cc.guild_id, {})[new_cc.name] = new_cc.content
         return await ctx.send(f'Created new command with name `{new_cc.name}`')
 
     @cc_base.command(name='delete')
@@ -129,6 +146,7 @@ class CustomCommands(commands.Cog, name='CustomCommands'):
         if cc_dict is None:
             return await ctx.send(f'No CC with name `{name}` found.')
         await self.db.delete_one({'guild_id': ctx.guild_id, 'name': name})
+        self.index.get(ctx.guild_id, {}).pop(name, None)
         return await ctx.send(f'Deleted CC with name `{name}` from the server.')
 
 
@@ -1,13 +1,20 @@
 import asyncio
+import logging
+import time
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import typing
 
+import bot_config as config
+from utils.budget import RateBudget
 from utils.checks import is_owner, can_use_dm
+from utils.errors import InvalidArgument
 from utils.functions import create_default_embed
 from .models.dm_objects import DMCategory, CategoryExists, DMPermissions, DMChannel
 
+log = logging.getLogger(__name__)
+
 
 async def get_category_and_embed(ctx):
     current_cat: DMCategory = await DMCategory.from_ctx(ctx)
@@ -18,9 +25,165 @@ async def get_category_and_embed(ctx):
     return current_cat, embed, (current_cat is not None)
 
 
+class SyncProgress:
+    def __init__(self, ctx, threshold: int = 25, interval: float = 2.0):
+        """
+        Reports the progress of a long permission sync by editing one message.
+
+        :param ctx: Context to send the progress message to.
+        :param threshold: Only report progress for syncs of at least this many channels.
+        :param interval: Minimum seconds between edits.
+        """
+        self.ctx = ctx
+        self.threshold = threshold
+        self.interval = interval
+        self.message = None
+        self._sending = False
+        self._last_edit = 0
+
+    async def __call__(self, done, total):
+        if total < self.threshold:
+            return
+        now = time.monotonic()
+        if self.message is None:
+            # Channels sync concurrently, only the first report sends the message, the rest skip until it exists
+            if self._sending:
+                return
+            self._sending = True
+            self._last_edit = now
+            self.message = await self.ctx.send(f'Syncing permissions... {done}/{total} channels')
+        elif now - self._last_edit >= self.interval and done < total:
+            self._last_edit = now
+            await self.message.edit(content=f'Syncing permissions... {done}/{total} channels')
+
+    async def finish(self, embed):
+        """
+        Replaces the progress message with the final embed, or sends it if there was no progress message.
+        """
+        if self.message is None:
+            return await self.ctx.send(embed=embed)
+        await self.message.edit(content=None, embed=embed)
+        return self.message
+
+
 class DMCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        if bot.is_ready():
+            bot.loop.create_task(self.preload())
+        self.resume_deletes.start()
+        if config.DM_RECONCILE_INTERVAL > 0 and config.DM_RECONCILE_BUDGET > 0:
+            self.reconcile_permissions.start()
+
+    def cog_unload(self):
+        self.resume_deletes.cancel()
+        self.reconcile_permissions.cancel()
+
+    @tasks.loop(count=1)
+    async def resume_deletes(self):
+        resumed = await DMCategory.resume_deletes(self.bot)
+        if resumed:
+            log.info(f'Resumed deleting {resumed} DM categories.')
+
+    @resume_deletes.before_loop
+    async def before_resume_deletes(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(minutes=max(config.DM_RECONCILE_INTERVAL, 1))
+    async def reconcile_permissions(self):
+        """
+        Finds DM channels whose overwrites were edited by hand and syncs them back to the stored permissions.
+
+        Overwrites are compared against the gateway cache, so only channels that drifted cost a REST call, and those
+        are spaced out to stay within `DM_RECONCILE_BUDGET` edits per minute.
+        """
+        budget = RateBudget(config.DM_RECONCILE_BUDGET)
+        checked = drifted = 0
+        async for data in self.bot.mdb['dmcategories'].find({'deleting': {'$ne': True}}, {'_id': 0}):
+            # Prefer the cached category, it may have changes that are not written yet
+            category = self.bot.dm_categories.peek(data['guild_id'], data['owner_id'])
+            if category is None:
+                try:
+                    category = DMCategory.from_dict(self.bot, data)
+                except InvalidArgument:
+                    continue
+            for channel in category.channels:
+                checked += 1
+                if not await channel.sync_permissions(dry_run=True):
+                    continue
+                drifted += 1
+                # Give way to commands, this is the lowest priority work the bot does
+                while self.bot.scheduler.queued:
+                    await asyncio.sleep(1)
+                await budget.acquire()
+                try:
+                    await channel.sync_permissions()
+                except discord.HTTPException:
+                    log.warning(f'Could not sync drifted DM channel {channel.channel.id}.')
+            await asyncio.sleep(0)
+        if drifted:
+            log.info(f'Synced {drifted} of {checked} DM channels that drifted from their stored permissions.')
+
+    @reconcile_permissions.before_loop
+    async def before_reconcile(self):
+        await self.bot.wait_until_ready()
+
+    async def preload(self):
+        await self.bot.dm_categories.load_owners(self.bot.mdb['dmcategories'])
+
+    async def track_channel(self, channel):
+        """
+        Adds a channel created in (or moved into) a DM category to that category's document.
+        """
+        if not isinstance(channel, discord.TextChannel):
+            return
+        key = self.bot.dm_categories.owner_of(channel.category_id)
+        if key is None:
+            return
+        category = self.bot.dm_categories.peek(*key)
+        if category is not None and category.get_channel(channel.id) is None:
+            category.add_channel(DMChannel(category, [], channel))
+        await self.bot.mdb['dmcategories'].update_one(
+            {'category_id': channel.category_id, 'channels.channel_id': {'$ne': channel.id}},
+            {'$push': {'channels': {'channel_id': channel.id, 'permissions': []}}}
+        )
+
+    async def untrack_channel(self, channel, category_id):
+        """
+        Removes a channel deleted from (or moved out of) a DM category from that category's document.
+        """
+        key = self.bot.dm_categories.owner_of(category_id)
+        if key is None:
+            return
+        category = self.bot.dm_categories.peek(*key)
+        if category is not None:
+            category.remove_channel(channel.id)
+        await self.bot.mdb['dmcategories'].update_one({'category_id': category_id},
+                                                      {'$pull': {'channels': {'channel_id': channel.id}}})
+
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel):
+        await self.track_channel(channel)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        if self.bot.dm_categories.owner_of(channel.id) is not None:
+            # A DM category was deleted by hand, its document can never be loaded again
+            self.bot.dm_categories.forget(channel.id)
+            await self.bot.mdb['dmcategories'].delete_one({'category_id': channel.id})
+        elif isinstance(channel, discord.TextChannel):
+            await self.untrack_channel(channel, channel.category_id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        if not isinstance(after, discord.TextChannel) or before.category_id == after.category_id:
+            return
+        await self.untrack_channel(before, before.category_id)
+        await self.track_channel(after)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        await self.bot.dm_categories.invalidate_role(role)
 
     @commands.group(name='dm', invoke_without_command=True)
     @can_use_dm()
@@ -92,10 +255,30 @@ class DMCommands(commands.Cog):
         Will add new channels to the bot's database and will sync the permissions of all channels.
         """
         current_cat, embed, test = await get_category_and_embed(ctx)
+        progress = SyncProgress(ctx)
         if test:
-            new_channels = len(await current_cat.sync_permissions(self.bot))
+            new_channels = len(await current_cat.sync_permissions(self.bot, progress=progress))
             embed.title = f'{ctx.author.display_name} updates their DM Channels.'
             embed.description = f'Updated {new_channels} new channel(s) and synced all permissions.'
+        await progress.finish(embed)
+
+    @dm.command(name='diff', description='Shows channels whose permissions are out of sync.')
+    @can_use_dm()
+    async def dm_diff(self, ctx):
+        """
+        Shows which permissions `dm update` would change in each of your channels, without changing anything.
+        """
+        current_cat, embed, test = await get_category_and_embed(ctx)
+        if test:
+            embed.title = f'{ctx.author.display_name} checks their DM channel permissions.'
+            out_of_sync = 0
+            for channel in current_cat.channels:
+                diff = await channel.sync_permissions(dry_run=True)
+                if diff:
+                    out_of_sync += 1
+                    if len(embed.fields) < 25:
+                        embed.add_field(name=channel.channel.name, value=str(diff))
+            embed.description = f'{out_of_sync} of {len(current_cat.channels)} channel(s) out of sync.'
         await ctx.send(embed=embed)
 
     # Roles
@@ -111,13 +294,12 @@ class DMCommands(commands.Cog):
         """
         current_cat, embed, test = await get_category_and_embed(ctx)
         if test:
-            channel = [dmchannel for dmchannel in current_cat.channels if dmchannel.channel.id == channel_to_change.id]
-            if not channel:
+            channel: DMChannel = current_cat.get_channel(channel_to_change.id)
+            if channel is None:
                 return await ctx.send(f'Channel was not found in your category. Try running `{ctx.prefix}dm update`')
-            channel: DMChannel = channel[0]
             new_perms = DMPermissions(type_=0, perm_type=type_, obj=to_add, guild=ctx.guild)
-            await channel.add_permission(new_perms)
-            await current_cat.commit(self.bot)
+            async with current_cat.batch(self.bot) as batch:
+                batch.add_permission(channel, new_perms)
             embed.title = f'{ctx.author.display_name} adds {to_add.name} to #{channel.channel.name}'
             embed.description = f'{to_add.name} has been added to #{channel.channel.name}' \
                                 f' with {new_perms.perm_type} permissions'
@@ -134,18 +316,20 @@ class DMCommands(commands.Cog):
         `ignore` is one channel you can specify that the command will ignore, usually your "DM Hub"/Secret Channel.
         """
         current_cat, embed, test = await get_category_and_embed(ctx)
+        progress = SyncProgress(ctx)
         if test:
             embed.title = f'{ctx.author.display_name} adds {to_add.name} to all DM channels.'
-            for channel in current_cat.channels:
-                if ignore is not None:
-                    if channel.channel.id == ignore.id:
-                        embed.add_field(name=channel.channel.name, value='Ignored.')
-                        continue
-                new_perms = DMPermissions(type_=0, perm_type=type_, obj=to_add, guild=ctx.guild)
-                await channel.add_permission(new_perms)
-                await current_cat.commit(self.bot)
-                embed.add_field(name=channel.channel.name, value=f'Added @{to_add.name} with {new_perms.perm_type}')
-        return await ctx.send(embed=embed)
+            async with current_cat.batch(self.bot, progress=progress) as batch:
+                for channel in current_cat.channels:
+                    if ignore is not None:
+                        if channel.channel.id == ignore.id:
+                            embed.add_field(name=channel.channel.name, value='Ignored.')
+                            continue
+                    new_perms = DMPermissions(type_=0, perm_type=type_, obj=to_add, guild=ctx.guild)
+                    batch.add_permission(channel, new_perms)
+                    embed.add_field(name=channel.channel.name,
+                                    value=f'Added @{to_add.name} with {new_perms.perm_type}')
+        return await progress.finish(embed)
 
     @dm.command(name='removerole', description='Removes a role from a channel.', aliases=['rr'])
     @can_use_dm()
@@ -155,19 +339,17 @@ class DMCommands(commands.Cog):
         """
         current_cat, embed, test = await get_category_and_embed(ctx)
         if test:
-            channel = [dmchannel for dmchannel in current_cat.channels if dmchannel.channel.id == channel_to_change.id]
-            if not channel:
+            channel: DMChannel = current_cat.get_channel(channel_to_change.id)
+            if channel is None:
                 return await ctx.send(f'Channel was not found in your category. Try running `{ctx.prefix}dm update`')
-            channel: DMChannel = channel[0]
-            result = await channel.remove_perm_for(to_remove)
-            await current_cat.commit(self.bot)
+            async with current_cat.batch(self.bot) as batch:
+                result = batch.remove_perm_for(channel, to_remove)
             if result:
                 embed.title = f'{ctx.author.display_name} removes {to_remove.name} from {channel_to_change.name}!'
                 embed.description = f'{to_remove.name} has been removed from {channel_to_change.name}.'
             else:
                 embed.title = f'{ctx.author.display_name} tries to remove {to_remove.name} from {channel_to_change.name}!'
                 embed.description = f'There is no existing permission for {to_remove.name} in {channel_to_change.name}.'
-            await channel.sync_permissions()
         return await ctx.send(embed=embed)
 
     @dm.command(name='removerole-all', description='Removes a roll from all channels.', aliases=['rra'])
@@ -177,15 +359,15 @@ class DMCommands(commands.Cog):
         Removes a role from all of your DM channels.
         """
         current_cat, embed, test = await get_category_and_embed(ctx)
+        progress = SyncProgress(ctx)
         if test:
             embed.title = f'{ctx.author.display_name} removes {to_remove.name} from all DM channels!'
-            for channel in current_cat.channels:
-                result = await channel.remove_perm_for(to_remove)
-                if result:
-                    embed.add_field(name=channel.channel.name, value=f'Removed Permissions for {to_remove.name}')
-            await current_cat.commit(self.bot)
-            await channel.sync_permissions()
-        return await ctx.send(embed=embed)
+            async with current_cat.batch(self.bot, progress=progress) as batch:
+                for channel in current_cat.channels:
+                    result = batch.remove_perm_for(channel, to_remove)
+                    if result:
+                        embed.add_field(name=channel.channel.name, value=f'Removed Permissions for {to_remove.name}')
+        return await progress.finish(embed)
 
     # Users
 
@@ -199,13 +381,12 @@ class DMCommands(commands.Cog):
         """
         current_cat, embed, test = await get_category_and_embed(ctx)
         if test:
-            channel = [dmchannel for dmchannel in current_cat.channels if dmchannel.channel.id == channel_to_change.id]
-            if not channel:
+            channel: DMChannel = current_cat.get_channel(channel_to_change.id)
+            if channel is None:
                 return await ctx.send(f'Channel was not found in your category. Try running `{ctx.prefix}dm update`')
-            channel: DMChannel = channel[0]
             new_perms = DMPermissions(type_=1, perm_type=type_, obj=to_add, guild=ctx.guild)
-            await channel.add_permission(new_perms)
-            await current_cat.commit(self.bot)
+            async with current_cat.batch(self.bot) as batch:
+                batch.add_permission(channel, new_perms)
             embed.title = f'{ctx.author.display_name} adds {to_add.display_name} to #{channel.channel.name}'
             embed.description = f'{to_add.display_name} has been added to ' \
                                 f'#{channel.channel.name} with {new_perms.perm_type} permissions'
@@ -219,12 +400,11 @@ class DMCommands(commands.Cog):
         """
         current_cat, embed, test = await get_category_and_embed(ctx)
         if test:
-            channel = [dmchannel for dmchannel in current_cat.channels if dmchannel.channel.id == channel_to_change.id]
-            if not channel:
+            channel: DMChannel = current_cat.get_channel(channel_to_change.id)
+            if channel is None:
                 return await ctx.send(f'Channel was not found in your category. Try running `{ctx.prefix}dm update`')
-            channel: DMChannel = channel[0]
-            result = await channel.remove_perm_for(to_remove)
-            await current_cat.commit(self.bot)
+            async with current_cat.batch(self.bot) as batch:
+                result = batch.remove_perm_for(channel, to_remove)
             if result:
                 embed.title = f'{ctx.author.display_name} removes ' \
                               f'{to_remove.display_name} from #{channel_to_change.name}!'
@@ -234,7 +414,6 @@ class DMCommands(commands.Cog):
                               f'{to_remove.display_name} from #{channel_to_change.name}!'
                 embed.description = f'There is no existing permission for ' \
                                     f'{to_remove.display_name} in #{channel_to_change.name}.'
-            await channel.sync_permissions()
         return await ctx.send(embed=embed)
 
     # Channel Modification (Create/Delete)
@@ -250,7 +429,7 @@ class DMCommands(commands.Cog):
         channel_name = channel_name.replace(' ', '-')
         current_cat, embed, test = await get_category_and_embed(ctx)
         if test:
-            channel = next((dmc for dmc in current_cat.channels if dmc.channel.name == channel_name), None)
+            channel = current_cat.get_channel_named(channel_name)
             if channel is not None:
                 return await ctx.send(f'There is already a channel named {channel_name} in your DM Category')
             await current_cat.category.create_text_channel(name=channel_name)
@@ -269,13 +448,13 @@ class DMCommands(commands.Cog):
         """
         current_cat, embed, test = await get_category_and_embed(ctx)
         if test:
-            channel = next((dmc for dmc in current_cat.channels if dmc.channel.id == channel_to_delete.id), None)
+            channel = current_cat.get_channel(channel_to_delete.id)
             if channel is None:
                 return await ctx.send(f'Channel was not found in your category. Try running `{ctx.prefix}dm update`')
             embed.title = f'{ctx.author.display_name} deletes {channel_to_delete.name}'
             embed.description = f'{channel_to_delete.name} has been deleted.'
             # Delete Channel
-            current_cat.channels.pop(current_cat.channels.index(channel))
+            current_cat.remove_channel(channel.channel.id)
             await current_cat.commit(self.bot)
             try:
                 await channel_to_delete.delete()
@@ -294,26 +473,23 @@ class DMCommands(commands.Cog):
         """
         current_cat, embed, test = await get_category_and_embed(ctx)
         if test:
-            for raw_channel in channels:
-                channel = next((dmc for dmc in current_cat.channels if dmc.channel.id == raw_channel.id), None)
-                index = current_cat.channels.index(channel)
-                if channel is None:
-                    return await ctx.send(
-                        f'Channel was not found in your category. Try running `{ctx.prefix}dm update`')
-                new_permissions = []
-                for perm in channel.permissions:
-                    if archive:
-                        x = perm.change_type(2)
-                        embed.add_field(name=raw_channel.name, value='Archived')
-                    else:
-                        x = perm.change_type(1)
-                        embed.add_field(name=raw_channel.name, value='Unarchived')
-                    new_permissions.append(x)
-                channel.permissions = new_permissions
-                current_cat.channels[index] = channel
+            dm_channels = [current_cat.get_channel(raw_channel.id) for raw_channel in channels]
+            if None in dm_channels:
+                return await ctx.send(f'Channel was not found in your category. Try running `{ctx.prefix}dm update`')
+            progress = SyncProgress(ctx)
+            async with current_cat.batch(self.bot, progress=progress) as batch:
+                for raw_channel, channel in zip(channels, dm_channels):
+                    for perm in channel.permissions:
+                        if archive:
+                            batch.add_permission(channel, perm.with_type(2))
+                            embed.add_field(name=raw_channel.name, value='Archived')
+                        else:
+                            batch.add_permission(channel, perm.with_type(1))
+                            embed.add_field(name=raw_channel.name, value='Unarchived')
             embed.title = f'{ctx.author.display_name} {"archives" if archive else "unarchives"} some channels!'
-            await current_cat.sync_permissions(self.bot)
-            await ctx.send(embed=embed)
+            embed.description = f'Synced {batch.rest_calls} channel(s), skipped {batch.skipped} REST call(s) ' \
+                                f'for unchanged channels.'
+            await progress.finish(embed)
 
     @dm.command(name='unarchive', aliases=['uarc'])
     @can_use_dm()
@@ -334,7 +510,7 @@ class DMCommands(commands.Cog):
         if test:
             if channel is None:
                 channel = ctx.channel
-            channel = next((dmc for dmc in current_cat.channels if dmc.channel.id == channel.id), None)
+            channel = current_cat.get_channel(channel.id)
             if channel is None:
                 return await ctx.send(f'Channel was not found in your category. Try running `{ctx.prefix}dm update`')
             embed.title = f'List of special permissions for {channel.channel.name}'
@@ -353,11 +529,10 @@ class DMCommands(commands.Cog):
         """
         current_cat, embed, test = await get_category_and_embed(ctx)
         if test:
-            channel = [dmchannel for dmchannel in current_cat.channels if dmchannel.channel.id == to_reset.id]
-            if not channel:
+            channel = current_cat.get_channel(to_reset.id)
+            if channel is None:
                 return await ctx.send(f'Channel was not found in your category. Try running `{ctx.prefix}dm update`')
             await to_reset.edit(sync_permissions=True)
-            channel = channel[0]
             channel.permissions = []
             await current_cat.commit(self.bot)
             embed.title = f'{ctx.author.display_name} resets the permissions of {to_reset.name}'
@@ -36,10 +36,17 @@ class Images(commands.Cog):
     def __init__(self, bot):
 
         self.bot = bot
-        self.session = aiohttp.ClientSession()
+        self._session = None
         self._cd = commands.CooldownMapping.from_cooldown(1, 30, commands.BucketType.user)
         self.url_regex = re.compile(r'(http(s?):)([/|.|\w|\s|-])*\.(?:jpg|jpeg|gif|png)')
 
+    @property
+    def session(self):
+        # Created on first use so loading the cog does not open a connection pool
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
     async def cog_check(self, ctx):
         bucket = self._cd.get_bucket(ctx.message)
         retry_after = bucket.update_rate_limit()
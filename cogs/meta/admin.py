@@ -1,3 +1,5 @@
+import datetime
+
 from discord.ext import commands
 from utils.checks import is_owner
 import discord
@@ -137,19 +139,23 @@ class Admin(commands.Cog):
 
     @admin.command(name='mute', description='Mutes a user. Prevents them from using the bot.')
     @is_owner()
-    async def mute(self, ctx, to_mute: discord.Member):
+    async def mute(self, ctx, to_mute: discord.Member, minutes: int = None):
         """
         Mutes a user from the bot.
+
+        If `minutes` is given, the mute will expire after that many minutes.
         """
-        record = {'_id': to_mute.id}
-        db = self.bot.mdb['muted_clients']
-        muted = await db.find_one(record)
-        if muted is None:
-            await db.insert_one(record)
-            await self.bot.update_muted_from_db()
-            return await ctx.send(f'User {to_mute.name}#{to_mute.discriminator} has been muted.')
-        else:
+        if minutes is not None and minutes <= 0:
+            return await ctx.send('Mute length must be at least 1 minute.')
+        if to_mute.id in self.bot.muted:
             return await ctx.send(f'User {to_mute.name}#{to_mute.discriminator} has already been muted.')
+        record = {'_id': to_mute.id, 'expires_at': None}
+        if minutes is not None:
+            record['expires_at'] = datetime.datetime.utcnow() + datetime.timedelta(minutes=minutes)
+        await self.bot.mdb['muted_clients'].update_one({'_id': to_mute.id}, {'$set': record}, upsert=True)
+        self.bot.muted.add(to_mute.id, record['expires_at'])
+        length = f' for {minutes} minute(s)' if minutes is not None else ''
+        return await ctx.send(f'User {to_mute.name}#{to_mute.discriminator} has been muted{length}.')
 
     @admin.command(name='unmute', description='Un-mutes a user.')
     @is_owner()
@@ -157,15 +163,11 @@ class Admin(commands.Cog):
         """
         Unmutes a user from the bot.
         """
-        record = {'_id': to_mute.id}
-        db = self.bot.mdb['muted_clients']
-        muted = await db.find_one(record)
-        if muted:
-            await db.delete_one(record)
-            await self.bot.update_muted_from_db()
-            return await ctx.send(f'User {to_mute.name}#{to_mute.discriminator} has been un-muted.')
-        else:
+        if to_mute.id not in self.bot.muted:
             return await ctx.send(f'User {to_mute.name}#{to_mute.discriminator} is not muted.')
+        await self.bot.mdb['muted_clients'].delete_one({'_id': to_mute.id})
+        self.bot.muted.remove(to_mute.id)
+        return await ctx.send(f'User {to_mute.name}#{to_mute.discriminator} has been un-muted.')
 
     # ---- Server Owner Commands ----
 
@@ -181,22 +183,14 @@ class Admin(commands.Cog):
         embed = create_default_embed(ctx)
         guild_id = str(ctx.guild.id)
         if to_change is None:
-            if guild_id in self.bot.prefixes:
-                prefix = self.bot.prefixes.get(guild_id, self.bot.prefix)
-            else:
-                dbsearch = await self.bot.mdb['prefixes'].find_one({'guild_id': guild_id})
-                if dbsearch is not None:
-                    prefix = dbsearch.get('prefix', self.bot.prefix)
-                else:
-                    prefix = self.bot.prefix
-                self.bot.prefixes[guild_id] = prefix
+            prefix = self.bot.prefixes.get(guild_id)
             embed.title = f'Prefix for {ctx.guild.name}'
             embed.description = f'Current Prefix: `{prefix}`'
             return await ctx.send(embed=embed)
         else:
             await ctx.bot.mdb['prefixes'].update_one({'guild_id': guild_id},
                                                      {'$set': {'prefix': to_change}}, upsert=True)
-            ctx.bot.prefixes[guild_id] = to_change
+            ctx.bot.prefixes.set(guild_id, to_change)
             embed.title = f'Prefix updated for {ctx.guild.name}!'
             embed.description = f'Server prefix updated to `{to_change}`'
             return await ctx.send(embed=embed)
@@ -4,7 +4,6 @@ import sys
 from discord.ext import commands
 from utils.errors import InvalidArgument, UnauthorizedServer, IsNotDM
 
-import sentry_sdk
 import logging
 
 log = logging.getLogger(__name__)
@@ -21,6 +20,7 @@ class CommandErrorHandler(commands.Cog):
             log.warning('SENTRY Error Handling is not setup.')
             return
 
+        import sentry_sdk
         with sentry_sdk.push_scope() as scope:
             scope.user = {"id": context.author.id, "username": str(context.author)}
             scope.set_tag("message.content", context.message.content)
@@ -1,7 +1,6 @@
 from discord.ext import commands, tasks
 import aiohttp
 import logging
-import dbl
 
 log = logging.getLogger(__name__)
 
@@ -9,7 +8,7 @@ log = logging.getLogger(__name__)
 class KeepAlive(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
+        self._session = None
         if (url := self.bot.api_keys['server_api_url']) and (key := self.bot.api_keys['server_api_key']):
             self.url = url
             self.key = key
@@ -17,10 +16,17 @@ class KeepAlive(commands.Cog):
         else:
             log.warning('Not starting Keep Alive server.')
         if (token := self.bot.api_keys['dbl_api_key']) is not None:
+            import dbl
             self.dbl_client = dbl.DBLClient(self.bot, token=token, autopost=True)
         else:
             log.warning('No DBL API key token provided.')
 
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
     def cog_unload(self):
         self.alive_post.cancel()
 
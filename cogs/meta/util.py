@@ -1,7 +1,9 @@
+import io
+import json
 import os
+import time
 from datetime import datetime
 
-import psutil
 from discord.ext import commands
 import discord
 
@@ -101,7 +103,22 @@ class Utility(commands.Cog):
         embed.set_thumbnail(url=str(self.bot.user.avatar_url))
         await ctx.send(embed=embed)
 
-    @commands.command(name='debug')
+    # ---- Command Metrics ----
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx):
+        self.record_command(ctx, failed=False)
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx, error):
+        self.record_command(ctx, failed=True)
+
+    def record_command(self, ctx, failed: bool):
+        started = getattr(ctx, 'command_started', None)
+        if started is None or ctx.command is None:
+            return
+        self.bot.command_metrics.record(ctx.command.qualified_name, time.perf_counter() - started, failed)
+
+    @commands.group(name='debug', invoke_without_command=True)
     async def debug(self, ctx):
         """
         Debugging commands for FrogBot
@@ -109,6 +126,7 @@ class Utility(commands.Cog):
         embed = create_default_embed(ctx)
         embed.title = 'FrogBot Debug'
         # -- Calculate Values --
+        import psutil
         proc = psutil.Process(os.getpid())
         cpu = psutil.cpu_percent()
         mem = psutil.virtual_memory()
@@ -123,9 +141,74 @@ class Utility(commands.Cog):
                                                    f'({round(100 * (mem_used / mem.total), 2)}%)')
         embed.add_field(name='CPU Usage', value=f'{round(cpu, 2)}%')
         embed.add_field(name='Commands', value=f'{command_count} total commands loaded.')
+        prefix_stats = self.bot.prefixes.stats
+        embed.add_field(name='Prefix Cache', value=f'{prefix_stats["size"]} custom prefixes\n'
+                                                   f'{prefix_stats["custom_lookups"]} custom / '
+                                                   f'{prefix_stats["default_lookups"]} default prefix lookups '
+                                                   f'({round(100 * prefix_stats["custom_rate"], 2)}% custom)')
+        queue_stats = self.bot.scheduler.stats
+        deepest = ', '.join(f'{x["guild_id"]}: {x["depth"]}' for x in queue_stats['deepest_guilds']) or 'None'
+        embed.add_field(name='Command Queue', value=f'{queue_stats["queued"]} queued, '
+                                                    f'{queue_stats["running"]}/{queue_stats["concurrency"]} running\n'
+                                                    f'Wait: {round(queue_stats["avg_wait"] * 1000)} ms avg, '
+                                                    f'{round(queue_stats["p95_wait"] * 1000)} ms p95, '
+                                                    f'{round(queue_stats["max_wait"] * 1000)} ms max\n'
+                                                    f'{queue_stats["shed"]} shed | Deepest: {deepest}',
+                        inline=False)
+        delete_stats = self.bot.deletion_queue.stats
+        embed.add_field(name='Message Deletion', value=f'{delete_stats["deleted"]} deleted, '
+                                                       f'{delete_stats["pending"]} pending\n'
+                                                       f'{delete_stats["bulk_calls"]} bulk / '
+                                                       f'{delete_stats["single_calls"]} single calls '
+                                                       f'({delete_stats["deletes_saved"]} saved)')
+        dm_stats = self.bot.dm_categories.stats
+        embed.add_field(name='DM Category Cache', value=f'{dm_stats["size"]} cached, {dm_stats["dirty"]} dirty\n'
+                                                        f'{round(100 * dm_stats["hit_rate"], 2)}% hit rate\n'
+                                                        f'{dm_stats["commits"]} commits / {dm_stats["writes"]} writes')
+        sheets = self.bot.get_cog('SheetApproval')
+        if sheets is not None:
+            sheet_stats = sheets.stats
+            embed.add_field(name='Pending Sheets', value=f'{sheet_stats["pending"]} pending\n'
+                                                         f'{sheet_stats["hits"]} sheet / {sheet_stats["misses"]} other '
+                                                         f'reactions ({round(100 * sheet_stats["hit_rate"], 2)}% '
+                                                         f'hit rate)\n'
+                                                         f'{sheet_stats["messages"]["size"]} messages cached '
+                                                         f'({round(100 * sheet_stats["messages"]["hit_rate"], 2)}% '
+                                                         f'hit rate)\n'
+                                                         f'{sheet_stats["updates_requested"]} updates / '
+                                                         f'{sheet_stats["updates_applied"]} edits')
+        slowest = self.bot.command_metrics.slowest(limit=5)
+        if slowest:
+            lines = []
+            for name, stats in slowest:
+                latency = stats.latency
+                lines.append(f'`{name}`: {stats.invocations} calls, '
+                             f'{round(latency.percentile(50) * 1000)}/{round(latency.percentile(95) * 1000)}/'
+                             f'{round(latency.percentile(99) * 1000)} ms, '
+                             f'{round(100 * stats.error_rate, 1)}% errors')
+            embed.add_field(name='Slowest Commands (p50/p95/p99)', value='\n'.join(lines), inline=False)
+        embed.set_footer(text=f'{embed.footer.text} | Use {ctx.prefix}debug json for the full metrics.')
 
         await ctx.send(embed=embed)
 
+    @debug.command(name='json')
+    async def debug_json(self, ctx):
+        """
+        Dumps command latency, cache and command queue metrics as JSON.
+        """
+        sheets = self.bot.get_cog('SheetApproval')
+        data = {
+            'commands': self.bot.command_metrics.to_dict(),
+            'prefixes': self.bot.prefixes.stats,
+            'scheduler': self.bot.scheduler.stats,
+            'deletion': self.bot.deletion_queue.stats,
+            'dm_categories': self.bot.dm_categories.stats,
+            'sheets': sheets.stats if sheets is not None else None,
+            'startup': self.bot.startup_report
+        }
+        out = io.BytesIO(json.dumps(data, indent=2).encode())
+        await ctx.send(file=discord.File(out, filename='frogbot_metrics.json'))
+
     @commands.command(name='invite')
     async def send_invite(self, ctx):
         """
@@ -1,14 +1,164 @@
+import asyncio
+
 from discord import Member, CategoryChannel, Guild
+
+import bot_config as config
 from utils.errors import InvalidArgument, CategoryExists
 from .dm_constants import *
 
+# Indexed by DMPermissions type and permission type
+OBJECT_TYPES = ('Role', 'Member', 'Everyone')
+PERMISSION_TYPES = ('Admin', 'Read/Send', 'Read-Only', 'Hidden')
+PERMISSION_OVERWRITES = (CHANNEL_ADMIN, CHANNEL_READ_WRITE, CHANNEL_READ, CHANNEL_HIDDEN)
+
+
+class OverwriteDiff:
+    def __init__(self, added: list, changed: list, removed: list):
+        """
+        Difference between a channel's current overwrites and the overwrites it should have.
+
+        :param added: Targets that need an overwrite.
+        :param changed: Targets whose overwrite is different.
+        :param removed: Targets whose overwrite should be removed.
+        """
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+
+    @classmethod
+    def between(cls, current: dict, target: dict):
+        current = {k.id: v for k, v in current.items()}
+        target_ids = {k.id for k in target}
+        added = [k for k in target if k.id not in current]
+        changed = [k for k, v in target.items() if k.id in current and current[k.id] != v]
+        removed = [k for k in current if k not in target_ids]
+        return cls(added, changed, removed)
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def __len__(self):
+        return len(self.added) + len(self.changed) + len(self.removed)
+
+    def __str__(self):
+        if not self:
+            return 'In sync.'
+
+        def names(targets):
+            return ', '.join(getattr(t, 'name', str(t)) for t in targets)
+
+        out = []
+        if self.added:
+            out.append(f'Add: {names(self.added)}')
+        if self.changed:
+            out.append(f'Change: {names(self.changed)}')
+        if self.removed:
+            out.append(f'Remove: {len(self.removed)} overwrite(s)')
+        return '\n'.join(out)
+
+
+class DMBatch:
+    def __init__(self, category, bot, progress=None):
+        """
+        Queues permission changes across the channels of a DMCategory and applies them when the batch closes.
+
+        Use as `async with category.batch(bot) as batch:`. When the block exits, every changed channel is synced in
+        one diff pass and the category is committed once. If the block raises, nothing is applied. If syncing a
+        channel fails, the stored permissions of every channel are put back and nothing is committed. Channels whose
+        stored permissions end up unchanged are not synced.
+
+        :param category: The DMCategory being changed.
+        :param bot: The bot, used to commit the category.
+        :param progress: Optional coroutine function called with (done, total) while syncing.
+        """
+        self.category = category
+        self.bot = bot
+        self.progress = progress
+        # Channel ID -> (DMChannel, {target ID: DMPermissions, or None to remove})
+        self._changes = {}
+        self.synced = []
+        self.diffs = []
+
+    def _pending(self, dm_channel) -> dict:
+        return self._changes.setdefault(dm_channel.channel.id, (dm_channel, {}))[1]
+
+    def get_permission(self, dm_channel, target_id: int):
+        """
+        Returns the permission a channel will have for a target once the batch is applied.
+        """
+        pending = self._changes.get(dm_channel.channel.id)
+        if pending is not None and target_id in pending[1]:
+            return pending[1][target_id]
+        return dm_channel.get_permission(target_id)
+
+    def add_permission(self, dm_channel, perm_to_add):
+        self._pending(dm_channel)[perm_to_add.applies_to.id] = perm_to_add
+
+    def remove_perm_for(self, dm_channel, obj):
+        if self.get_permission(dm_channel, obj.id) is None:
+            return None
+        self._pending(dm_channel)[obj.id] = None
+        return True
+
+    async def apply(self):
+        changes, self._changes = self._changes, {}
+        channels = []
+        # Stored permissions before the batch, restored if a sync fails so the cached category stays unchanged
+        previous = {}
+        for dm_channel, pending in changes.values():
+            previous[dm_channel] = dm_channel.permissions
+            changed = False
+            for target_id, perm in pending.items():
+                current = dm_channel.get_permission(target_id)
+                if perm is None:
+                    changed |= dm_channel.discard_permission(target_id) is not None
+                elif current is None or current.to_dict() != perm.to_dict():
+                    dm_channel.set_permission(perm)
+                    changed = True
+            if changed:
+                channels.append(dm_channel)
+        if not channels:
+            return
+        try:
+            self.diffs = await self.category.sync_channels(channels, progress=self.progress)
+        except Exception:
+            for dm_channel, permissions in previous.items():
+                dm_channel.permissions = permissions
+            raise
+        self.synced = channels
+        await self.category.commit(self.bot)
+
+    @property
+    def rest_calls(self) -> int:
+        return sum(1 for diff in self.diffs if diff)
+
+    @property
+    def skipped(self) -> int:
+        """
+        REST calls saved compared to editing every channel in the category.
+        """
+        return len(self.category.channels) - self.rest_calls
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.apply()
+
 
 class DMCategory:
+    # Categories are cached in bulk, so avoid a __dict__ per instance
+    __slots__ = ('_owner', '_category', '_guild', '_channels', '_names')
+
     def __init__(self, owner: Member, category: CategoryChannel, guild: Guild, channels: list):
         self._owner = owner
         self._category = category
         self._guild = guild
-        self._channels = channels
+        # Channel ID -> DMChannel, and channel name -> DMChannel (built on first use)
+        self._channels = {}
+        self._names = None
+        self.channels = channels
 
     @classmethod
     def from_dict(cls, bot, data):
@@ -45,7 +195,9 @@ class DMCategory:
     async def new(cls, bot, guild, owner):
         # Check to make sure User does not already have a DM Category
         db = bot.mdb['dmcategories']
-        exists = await db.find_one({'owner_id': owner.id, 'guild_id': guild.id})
+        exists = bot.dm_categories.get(guild.id, owner.id)
+        if exists is None:
+            exists = await db.find_one({'owner_id': owner.id, 'guild_id': guild.id, 'deleting': {'$ne': True}})
         if exists is not None:
             raise CategoryExists('User has an existing category in this server.')
         # Create Default Permissions
@@ -60,6 +212,7 @@ class DMCategory:
         category = DMCategory(owner=owner, category=new_category, guild=guild, channels=[])
         category.channels = [DMChannel(category=category, permissions=[], channel=new_channel)]
         await db.insert_one(category.to_dict())
+        bot.dm_categories.put(category)
         return category
 
     @classmethod
@@ -82,48 +235,129 @@ class DMCategory:
 
     @classmethod
     async def from_ctx(cls, ctx):
-        existing = await ctx.bot.mdb['dmcategories'].find_one({'owner_id': ctx.author.id, 'guild_id': ctx.guild.id})
+        cached = ctx.bot.dm_categories.get(ctx.guild.id, ctx.author.id)
+        if cached is not None:
+            return cached
+        existing = await ctx.bot.mdb['dmcategories'].find_one({'owner_id': ctx.author.id, 'guild_id': ctx.guild.id,
+                                                                'deleting': {'$ne': True}})
         if existing is not None:
             existing.pop('_id')
-            return cls.from_dict(ctx.bot, existing)
+            category = cls.from_dict(ctx.bot, existing)
+            ctx.bot.dm_categories.put(category)
+            if len(category.channels) < len(existing['channels']):
+                # Some channels were deleted while the bot was offline, write the document without them
+                await category.commit(ctx.bot)
+            return category
         else:
             return None
 
     async def commit(self, bot):
-        await bot.mdb['dmcategories'].update_one({'owner_id': self.owner.id, 'guild_id': self.guild.id},
-                                           {'$set': self.to_dict()}, upsert=True)
+        # Written to the database by the DM category cache on its next flush
+        bot.dm_categories.mark_dirty(self)
 
     async def delete(self, bot):
-        to_delete_id = self.category.id
+        """
+        Marks the category as deleting, then deletes its channels in the background.
+
+        The channels still to delete are recorded in the document, so `resume_deletes` can finish the job if the bot
+        restarts partway through.
+        """
+        bot.dm_categories.discard(self)
+        channel_ids = [c.channel.id for c in self.channels]
+        await bot.mdb['dmcategories'].update_one({'category_id': self.category.id},
+                                                 {'$set': {'deleting': True, 'pending_channel_ids': channel_ids}})
+        task = bot.loop.create_task(self.delete_channels(bot, self.guild, self.category.id, channel_ids))
+        return bot.dm_categories.track_delete(task)
+
+    @staticmethod
+    async def delete_channels(bot, guild, category_id: int, channel_ids: list):
+        """
+        Deletes a category's channels concurrently, then the category and its document.
+        """
+        db = bot.mdb['dmcategories']
+        semaphore = asyncio.Semaphore(config.DM_SYNC_CONCURRENCY)
 
-        for channel in self.channels:
-            await channel.delete()
+        async def delete(channel_id):
+            async with semaphore:
+                channel = guild.get_channel(channel_id)
+                if channel is not None:
+                    try:
+                        await channel.delete()
+                    except discord.HTTPException:
+                        pass
+                await db.update_one({'category_id': category_id}, {'$pull': {'pending_channel_ids': channel_id}})
 
-        try:
-            await self.category.delete()
-        except (discord.HTTPException, discord.NotFound):
-            pass
+        await asyncio.gather(*[delete(channel_id) for channel_id in channel_ids])
+
+        category = guild.get_channel(category_id)
+        if category is not None:
+            try:
+                await category.delete()
+            except discord.HTTPException:
+                pass
 
-        await bot.mdb['dmcategories'].delete_one({'category_id': to_delete_id})
+        await db.delete_one({'category_id': category_id})
+
+    @classmethod
+    async def resume_deletes(cls, bot) -> int:
+        """
+        Finishes deleting any categories that were still being deleted when the bot stopped.
+
+        :return: How many deletions were resumed.
+        """
+        tasks = []
+        async for data in bot.mdb['dmcategories'].find({'deleting': True}, {'_id': 0}):
+            guild = bot.get_guild(data['guild_id'])
+            if guild is None:
+                continue
+            tasks.append(cls.delete_channels(bot, guild, data['category_id'], data.get('pending_channel_ids', [])))
+        await asyncio.gather(*tasks)
+        return len(tasks)
 
     async def update_channels(self):
-        existings = [c.channel.id for c in self.channels]
         new = []
         # Add new channels
         for channel in self.category.channels:
-            if channel.id in existings:
+            if channel.id in self._channels:
                 continue
             new_channel = DMChannel(self, [], channel)
-            self.channels.append(new_channel), new.append(new_channel)
+            self.add_channel(new_channel), new.append(new_channel)
         return new
 
-    async def sync_permissions(self, bot):
+    async def sync_permissions(self, bot, progress=None):
         new = await self.update_channels()
-        for channel in self.channels:
-            await channel.sync_permissions()
+        await self.sync_channels(self.channels, progress=progress)
         await self.commit(bot)
         return new
 
+    def batch(self, bot, progress=None) -> DMBatch:
+        return DMBatch(self, bot, progress=progress)
+
+    async def sync_channels(self, channels, progress=None) -> list:
+        """
+        Syncs the permissions of several channels at once.
+
+        Each channel is its own rate-limit bucket for channel edits, so channels are synced concurrently, capped at
+        `DM_SYNC_CONCURRENCY` in flight to stay well under the global rate limit.
+
+        :param channels: The DMChannels to sync.
+        :param progress: Optional coroutine function called with (done, total) after each channel.
+        :return: The OverwriteDiff for each channel, in order.
+        """
+        semaphore = asyncio.Semaphore(config.DM_SYNC_CONCURRENCY)
+        done = 0
+
+        async def sync(channel):
+            nonlocal done
+            async with semaphore:
+                diff = await channel.sync_permissions()
+            done += 1
+            if progress is not None:
+                await progress(done, len(channels))
+            return diff
+
+        return await asyncio.gather(*[sync(channel) for channel in channels])
+
     @property
     def guild(self):
         return self._guild
@@ -136,13 +370,39 @@ class DMCategory:
     def category(self):
         return self._category
 
+    def get_channel(self, channel_id: int):
+        return self._channels.get(channel_id)
+
+    def get_channel_named(self, name: str):
+        dm_channel = self._names.get(name) if self._names is not None else None
+        if dm_channel is None or dm_channel.channel.name != name:
+            # Channels can be renamed in Discord, so rebuild the name index before giving up
+            self._names = {c.channel.name: c for c in self._channels.values()}
+            dm_channel = self._names.get(name)
+        return dm_channel
+
+    def add_channel(self, dm_channel):
+        self._channels[dm_channel.channel.id] = dm_channel
+        if self._names is not None:
+            self._names[dm_channel.channel.name] = dm_channel
+
+    def remove_channel(self, channel_id: int):
+        dm_channel = self._channels.pop(channel_id, None)
+        if dm_channel is not None and self._names is not None \
+                and self._names.get(dm_channel.channel.name) is dm_channel:
+            del self._names[dm_channel.channel.name]
+        return dm_channel
+
     @property
     def channels(self):
-        return self._channels
+        return list(self._channels.values())
 
     @channels.setter
     def channels(self, new_channels):
-        self._channels = new_channels
+        self._channels = {}
+        self._names = None
+        for dm_channel in new_channels:
+            self.add_channel(dm_channel)
 
     def __str__(self):
         return f"{self.category.name} | {len(self.channels)} channel(s) | {self.category.guild.name}"
@@ -153,8 +413,12 @@ class DMCategory:
 
 
 class DMChannel:
+    __slots__ = ('_category', '_permissions', '_channel')
+
     def __init__(self, category: DMCategory, permissions: list, channel: discord.TextChannel):
         self._category = category
+        # Target (role or member) ID -> DMPermissions
+        self._permissions = {}
         self.permissions = permissions
         self._channel = channel
 
@@ -171,44 +435,54 @@ class DMChannel:
     def to_dict(self):
         return {'channel_id': self.channel.id, 'permissions': [p.to_dict() for p in self.permissions]}
 
-    async def delete(self):
-        try:
-            await self.channel.delete()
-        except (discord.HTTPException, discord.NotFound):
-            pass
-
-    async def sync_permissions(self):
-        base_perms = {
-            self.category.guild.me: CHANNEL_ADMIN,
-            self.category.owner: CHANNEL_ADMIN,
-            self.category.guild.default_role: CHANNEL_HIDDEN
-        }
-        await self.channel.edit(sync_permissions=True)
+    def target_overwrites(self) -> dict:
+        """
+        Builds the overwrites this channel should have: the category's, then the stored permissions, then the base
+        permissions for the bot, the owner and @everyone.
+        """
+        overwrites = dict(self.category.category.overwrites)
         for perm in self.permissions:
-            await perm.apply_permission(self.channel)
-        for perm in base_perms:
-            await self.channel.set_permissions(perm, overwrite=base_perms[perm])
-
-    async def add_permission(self, perm_to_add):
-        intersect = [perm for perm in self.permissions if perm.applies_to.id == perm_to_add.applies_to.id]
-        if intersect:
-            intersect = intersect[0]
-            to_replace = self.permissions.index(intersect)
-            self.permissions[to_replace] = perm_to_add
-        else:
-            self.permissions.append(perm_to_add)
-        await self.sync_permissions()
-
-    async def remove_perm_for(self, obj):
-        intersect = [perm for perm in self.permissions if perm.applies_to.id == obj.id]
-        if intersect:
-            intersect = intersect[0]
-            to_remove = self.permissions.index(intersect)
-            self.permissions.pop(to_remove)
-            await self.sync_permissions()
-            return True
-        else:
-            return None
+            overwrites[perm.applies_to] = perm.permissions
+        overwrites[self.category.guild.me] = CHANNEL_ADMIN
+        overwrites[self.category.owner] = CHANNEL_ADMIN
+        overwrites[self.category.guild.default_role] = CHANNEL_HIDDEN
+        return overwrites
+
+    async def sync_permissions(self, dry_run: bool = False) -> OverwriteDiff:
+        """
+        Brings the channel's overwrites in line with the stored permissions in at most one edit.
+
+        :param dry_run: Only work out the changes, don't apply them.
+        :return: The changes that were (or would be) made.
+        """
+        target = self.target_overwrites()
+        diff = OverwriteDiff.between(self.channel.overwrites, target)
+        if diff and not dry_run:
+            await self.channel.edit(overwrites=target)
+        return diff
+
+    def get_permission(self, target_id: int):
+        return self._permissions.get(target_id)
+
+    def set_permission(self, perm):
+        """
+        Stores a permission without syncing the channel.
+        """
+        self._permissions[perm.applies_to.id] = perm
+
+    def discard_permission(self, target_id: int):
+        """
+        Removes a stored permission without syncing the channel.
+        """
+        return self._permissions.pop(target_id, None)
+
+    @property
+    def permissions(self):
+        return list(self._permissions.values())
+
+    @permissions.setter
+    def permissions(self, new_permissions):
+        self._permissions = {perm.applies_to.id: perm for perm in new_permissions}
 
     @property
     def category(self):
@@ -228,12 +502,15 @@ class DMChannel:
 
 
 class DMPermissions:
+    # The overwrite and the display names are looked up from the type indexes when needed
+    __slots__ = ('_type', '_perm_type', '_obj', '_guild')
+
     def __init__(self, type_: int, obj, perm_type: int, guild: Guild):
+        if perm_type not in range(len(PERMISSION_OVERWRITES)):
+            raise InvalidArgument('Permission Type must be in range 0 - 3.')
         self._type = type_
         self._perm_type = perm_type
         self._obj = obj
-        self._obj_type = ['Role', 'Member', 'Everyone'][type_]
-        self._perms = [CHANNEL_ADMIN, CHANNEL_READ_WRITE, CHANNEL_READ, CHANNEL_HIDDEN][perm_type]
         self._guild = guild
 
     @classmethod
@@ -262,10 +539,11 @@ class DMPermissions:
             'obj_id': self.applies_to.id
         }
 
-    def change_type(self, new_type: int):
-        self._perm_type = new_type
-        self._perms = [CHANNEL_ADMIN, CHANNEL_READ_WRITE, CHANNEL_READ, CHANNEL_HIDDEN][new_type]
-        return self
+    def with_type(self, new_type: int):
+        """
+        Returns a copy of this permission with a different permission type.
+        """
+        return DMPermissions(self._type, self._obj, new_type, self._guild)
 
     @property
     def raw_perm_type(self):
@@ -273,11 +551,11 @@ class DMPermissions:
 
     @property
     def permissions(self):
-        return self._perms
+        return PERMISSION_OVERWRITES[self._perm_type]
 
     @property
     def object_type(self):
-        return self._obj_type
+        return OBJECT_TYPES[self._type]
 
     @property
     def applies_to(self):
@@ -289,10 +567,7 @@ class DMPermissions:
 
     @property
     def perm_type(self):
-        return ['Admin', 'Read/Send', 'Read-Only', 'Hidden'][self._perm_type]
-
-    async def apply_permission(self, channel):
-        await channel.set_permissions(self.applies_to, overwrite=self.permissions)
+        return PERMISSION_TYPES[self._perm_type]
 
     def __repl__(self):
         return f'<DMPermission obj_type={self.object_type}, applies_to={self.applies_to}, guild={self.guild}, ' \
@@ -1,27 +1,33 @@
+import asyncio
 import logging
 
 import discord
 from discord.ext import commands
+from pymongo import ReturnDocument
 
+import bot_config as config
 from utils.checks import is_personal_server, is_owner
 from utils.constants import BOT_MODS
 from utils.functions import create_default_embed
+from utils.message_cache import MessageCache
 
 log = logging.getLogger('sheet approval')
 
 
 class ToBeApproved:
-    def __init__(self, message_id: int, approvals: list, channel_id: int, owner_id: int):
+    def __init__(self, message_id: int, approvals: list, channel_id: int, owner_id: int, version: int = 0):
         """
         :param message_id: ID of Message that created this.
         :param approvals: List of Member ID's who have approved the Sheet
         :param channel_id: Channel ID that the message was sent in
         :param owner_id: Member ID of owner of sheet.
+        :param version: Number of approval changes, used to find the newest state of a sheet.
         """
         self.message_id = message_id
         self.approvals = approvals
         self.channel_id = channel_id
         self.owner_id = owner_id
+        self.version = version
 
     @classmethod
     def from_dict(cls, data):
@@ -32,21 +38,58 @@ class ToBeApproved:
             'message_id': self.message_id,
             'approvals': self.approvals,
             'channel_id': self.channel_id,
-            'owner_id': self.owner_id
+            'owner_id': self.owner_id,
+            'version': self.version
         }
 
-    async def get_message(self, guild):
+    async def get_message(self, guild, messages: MessageCache = None, state=None):
         msg = guild.get_channel(self.channel_id)
         if msg is not None:
-            msg = await msg.fetch_message(self.message_id)
+            if messages is not None:
+                msg = await messages.fetch(msg, self.message_id, state=state)
+            else:
+                msg = await msg.fetch_message(self.message_id)
         return msg
 
-    async def commit(self, db):
-        db.update_one({'message_id': self.message_id}, {'$set': self.to_dict()}, upsert=True)
+    @classmethod
+    async def add_approval(cls, db, message_id: int, approver_id: int):
+        """
+        Atomically adds an approval to a sheet that is still waiting for approval.
+
+        :return: The updated sheet, or None if the approval was not added.
+        """
+        result = await db.find_one_and_update(
+            # Not the owner, not already approved by them and fewer than two approvals
+            {'message_id': message_id, 'owner_id': {'$ne': approver_id}, 'approvals': {'$ne': approver_id},
+             'approvals.1': {'$exists': False}},
+            {'$addToSet': {'approvals': approver_id}, '$inc': {'version': 1}},
+            projection={'_id': 0}, return_document=ReturnDocument.AFTER
+        )
+        return cls.from_dict(result) if result is not None else None
+
+    @classmethod
+    async def remove_approval(cls, db, message_id: int, user_id: int):
+        """
+        Atomically removes an approval from a sheet that is still waiting for approval.
+
+        :return: The updated sheet, or None if there was no approval to remove.
+        """
+        result = await db.find_one_and_update(
+            {'message_id': message_id, 'approvals': user_id, 'approvals.1': {'$exists': False}},
+            {'$pull': {'approvals': user_id}, '$inc': {'version': 1}},
+            projection={'_id': 0}, return_document=ReturnDocument.AFTER
+        )
+        return cls.from_dict(result) if result is not None else None
+
+    async def fields(self, guild, bot, messages: MessageCache = None, announce: bool = False):
+        """
+        Edits the sheet's embed to show its approvals.
 
-    async def fields(self, guild, bot):
-        message = await self.get_message(guild)
-        embed = message.embeds[0]
+        :param announce: Whether to also announce the approval in the general channel.
+        """
+        message = await self.get_message(guild, messages, state=bot._connection)
+        # Don't change the (possibly cached) message's embed until the edit goes through
+        embed = message.embeds[0].copy()
         embed.clear_fields()
         for approval in self.approvals:
             x = guild.get_member(approval)
@@ -60,7 +103,7 @@ class ToBeApproved:
                                   f' and then go to <#608030916778000395> and do the pinned commands for your sheet!',
                             inline=False)
             general = None
-            if bot.personal_server['general_channel'] is not None:
+            if announce and bot.personal_server['general_channel'] is not None:
                 general = guild.get_channel(bot.personal_server['general_channel'])
             if general is not None:
                 await general.send(f'{mention.mention}, your character with the following content has been approved:\n'
@@ -69,30 +112,12 @@ class ToBeApproved:
                                    allowed_mentions=discord.AllowedMentions(users=[mention]))
         await message.edit(embed=embed)
 
-    async def add_approval(self, guild, approver, bot):
-        if approver.id in self.approvals:
-            return
-        if approver.id == self.owner_id:
-            return
-
-        self.approvals.append(approver.id)
-
-        if len(self.approvals) >= 2:
-            await self.approve(guild, bot)
-        else:
-            await self.fields(guild, bot)
-
-    async def remove_approval(self, guild, user_id, bot):
-        member = guild.get_member(user_id)
-        if member.id not in self.approvals:
-            return
-        self.approvals.remove(member.id)
-        await self.fields(guild, bot)
-
-    async def approve(self, guild, bot):
+    async def approve(self, guild):
+        """
+        Gives the owner of an approved sheet their player role. The embed is updated separately.
+        """
         if len(self.approvals) < 2:
             return
-        await self.fields(guild, bot)
         member = guild.get_member(self.owner_id)
         if member is None:
             return None
@@ -112,13 +137,112 @@ APPROVAL_ROLES = ('dm', 'lord of the sheet')
 class SheetApproval(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # Message IDs of sheets still waiting for approval
+        self.pending = set()
+        # Sheet messages the bot sent or edited
+        self.messages = MessageCache(max_size=config.SHEET_CACHE_SIZE)
+        # Message ID -> (guild ID, newest sheet, announce, task) for sheets with an embed edit waiting
+        self._updates = {}
+        # Message ID -> newest sheet version seen, so a late result can't replace a newer one
+        self._versions = {}
+        self.pending_hits = 0
+        self.pending_misses = 0
+        self.updates_requested = 0
+        self.updates_applied = 0
+        if bot.is_ready():
+            bot.loop.create_task(self.preload())
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.flush_updates())
+
+    async def preload(self):
+        """
+        Loads the message IDs of every sheet still waiting for approval.
+        """
+        pending = set()
+        async for sheet in self.bot.mdb['to_approve'].find({}, {'_id': 0, 'message_id': 1, 'approvals': 1}):
+            if len(sheet.get('approvals', [])) < 2:
+                pending.add(sheet['message_id'])
+        self.pending = pending
+        log.info(f'Loaded {len(pending)} pending sheets.')
+
+    @property
+    def stats(self) -> dict:
+        total = self.pending_hits + self.pending_misses
+        return {
+            'pending': len(self.pending),
+            'hits': self.pending_hits,
+            'misses': self.pending_misses,
+            'hit_rate': (self.pending_hits / total) if total else 0.0,
+            'messages': self.messages.stats,
+            'updates_waiting': len(self._updates),
+            'updates_requested': self.updates_requested,
+            'updates_applied': self.updates_applied
+        }
+
+    def schedule_update(self, sheet, guild, announce: bool = False):
+        """
+        Edits a sheet's embed once its update window closes, coalescing every change made during the window.
+        """
+        self.updates_requested += 1
+        # Reactions handled at the same time can finish in any order, the version tells which state is newest
+        newest = sheet.version > self._versions.get(sheet.message_id, -1)
+        if newest:
+            self._versions[sheet.message_id] = sheet.version
+        waiting = self._updates.get(sheet.message_id)
+        if waiting is not None:
+            _, latest, announced, task = waiting
+            self._updates[sheet.message_id] = (guild.id, sheet if newest else latest, announced or announce, task)
+            return
+        if not newest and not announce:
+            # Older than a state that was already shown
+            return
+        task = self.bot.loop.create_task(self._delayed_update(sheet.message_id))
+        self._updates[sheet.message_id] = (guild.id, sheet, announce, task)
+
+    async def _delayed_update(self, message_id):
+        await asyncio.sleep(config.SHEET_UPDATE_DELAY)
+        guild_id, sheet, announce, _ = self._updates.pop(message_id)
+        try:
+            await self.update_sheet(sheet, guild_id, announce)
+        except Exception:
+            log.exception(f'Error while updating sheet {message_id}.')
+
+    async def update_sheet(self, sheet, guild_id, announce: bool = False):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+        self.updates_applied += 1
+        try:
+            await sheet.fields(guild, self.bot, self.messages, announce=announce)
+        except discord.NotFound:
+            # The sheet's message was deleted
+            self.messages.discard(sheet.message_id)
+
+    async def flush_updates(self):
+        """
+        Applies every waiting embed edit now, used when shutting down.
+        """
+        updates, self._updates = self._updates, {}
+        for message_id, (guild_id, sheet, announce, task) in updates.items():
+            task.cancel()
+            try:
+                await self.update_sheet(sheet, guild_id, announce)
+            except Exception:
+                log.exception(f'Error while updating sheet {message_id}.')
 
-    async def sheet_from_emoji(self, payload) -> ToBeApproved:
+    async def approver_from_emoji(self, payload) -> discord.Member:
         # Check the Guild
         guild_id = payload.guild_id
         if guild_id != self.bot.personal_server['server_id']:
             return None
 
+        # Most reactions are not on sheets, skip them without touching the database
+        if payload.message_id not in self.pending:
+            self.pending_misses += 1
+            return None
+        self.pending_hits += 1
+
         # Check the Roles
         member = payload.member
         if member is None:
@@ -127,39 +251,39 @@ class SheetApproval(commands.Cog):
                 return None
         if len([role for role in member.roles if role.name.lower() in APPROVAL_ROLES]) == 0:
             return None
-
-        # Check to see if it's an existing sheet
-        result = await self.bot.mdb['to_approve'].find_one({'message_id': payload.message_id})
-        if result is None:
-            return None
-        # Get rid of object id
-        result.pop('_id')
-
-        sheet: ToBeApproved = ToBeApproved.from_dict(result)
-        return sheet
+        return member
 
     @commands.Cog.listener('on_raw_reaction_add')
     async def check_for_approval(self, payload):
-        sheet: ToBeApproved = await self.sheet_from_emoji(payload)
-        if sheet is None:
+        approver = await self.approver_from_emoji(payload)
+        if approver is None:
             return
-        if len(sheet.approvals) >= 2:
+
+        # The database applies the change, so reactions handled at the same time can't overwrite each other
+        sheet = await ToBeApproved.add_approval(self.bot.mdb['to_approve'], payload.message_id, approver.id)
+        if sheet is None:
             return
 
         guild = self.bot.get_guild(payload.guild_id)
-
-        await sheet.add_approval(guild, payload.member, self.bot)
-        await sheet.commit(self.bot.mdb['to_approve'])
+        approved = len(sheet.approvals) >= 2
+        # Only the reaction that adds the second approval gets here with two, so the approval is announced once
+        self.schedule_update(sheet, guild, announce=approved)
+        if approved:
+            self.pending.discard(sheet.message_id)
+            await sheet.approve(guild)
 
     @commands.Cog.listener('on_raw_reaction_remove')
     async def check_for_deny(self, payload):
-        sheet: ToBeApproved = await self.sheet_from_emoji(payload)
+        approver = await self.approver_from_emoji(payload)
+        if approver is None:
+            return
+
+        sheet = await ToBeApproved.remove_approval(self.bot.mdb['to_approve'], payload.message_id, approver.id)
         if sheet is None:
             return
 
         guild = self.bot.get_guild(payload.guild_id)
-        await sheet.remove_approval(guild, payload.user_id, self.bot)
-        await sheet.commit(self.bot.mdb['to_approve'])
+        self.schedule_update(sheet, guild)
 
     @commands.command(name='sheet', aliases=['submit'])
     @is_personal_server()
@@ -179,12 +303,14 @@ class SheetApproval(commands.Cog):
             return await ctx.send('This channel is not valid for submitting sheets.')
 
         msg = await ctx.send(embed=embed)
+        self.messages.put(msg)
 
         new_sheet = ToBeApproved(message_id=msg.id,
                                  approvals=[],
                                  channel_id=ctx.channel.id,
                                  owner_id=ctx.author.id)
         await self.bot.mdb['to_approve'].insert_one(new_sheet.to_dict())
+        self.pending.add(new_sheet.message_id)
 
     @commands.command('cleanup_sheets')
     @is_personal_server()
@@ -210,6 +336,9 @@ class SheetApproval(commands.Cog):
             except discord.NotFound:
                 count += 1
                 await db.delete_one({'message_id': sheet.message_id})
+                self.pending.discard(sheet.message_id)
+                self.messages.discard(sheet.message_id)
+                self._versions.pop(sheet.message_id, None)
         embed.description = f'Pruned {count} Sheet{"s" if count != 1 else ""} from the DB.'
         await ctx.send(embed=embed)
 
@@ -1,39 +1,39 @@
 import datetime as datetime
 import logging
 import sys
+import time
 
 import discord
 import motor.motor_asyncio
 from discord.ext import commands, tasks
 
 import bot_config as config
+from utils.constants import COMMAND_COSTS
 from utils.context import Context as CustomContext
-from utils.functions import try_delete
-
-import sentry_sdk
+from utils.deletion import DeletionQueue
+from utils.dm_cache import DMCategoryCache
+from utils.indexes import check_query_plans, ensure_indexes
+from utils.metrics import CommandMetrics
+from utils.muted import MutedRegistry
+from utils.prefixes import PrefixCache
+from utils.scheduler import CommandScheduler
 
 COGS = (
-    'cogs.meta.util', 'jishaku', 'cogs.meta.admin', 'cogs.meta.error_handling', 'cogs.meta.info',
+    'cogs.meta.util', 'cogs.meta.admin', 'cogs.meta.error_handling', 'cogs.meta.info',
     'cogs.meta.keep_alive', 'cogs.custom_commands', 'cogs.fun', 'cogs.moderation', 'cogs.images',
     'cogs.quest_roles', 'cogs.dm_commands', 'cogs.sheet_approval',
     'cogs.meta.help'
 )
 
+# Dev tooling, loaded the first time the owner uses one of the listed commands
+LAZY_COGS = {
+    'jishaku': ('jishaku', 'jsk'),
+}
+
 
 async def get_prefix(client, message):
-    if not message.guild:
-        return commands.when_mentioned_or(config.PREFIX)(client, message)
-    guild_id = str(message.guild.id)
-    if guild_id in client.prefixes:
-        prefix = client.prefixes.get(guild_id, config.PREFIX)
-    else:
-        dbsearch = await client.mdb['prefixes'].find_one({'guild_id': guild_id})
-        if dbsearch is not None:
-            prefix = dbsearch.get('prefix', config.PREFIX)
-        else:
-            prefix = config.PREFIX
-        client.prefixes[guild_id] = prefix
-    return commands.when_mentioned_or(prefix)(client, message)
+    guild_id = message.guild.id if message.guild else None
+    return list(client.prefixes.matcher(guild_id, client.user.id))
 
 
 class FrogBot(commands.Bot):
@@ -44,8 +44,9 @@ class FrogBot(commands.Bot):
         self._prefix = config.PREFIX
         self.mongo_client = motor.motor_asyncio.AsyncIOMotorClient(config.MONGO_URL)
         self.mdb = self.mongo_client[config.MONGO_DB]
-        self.muted = set()
-        self.prefixes = dict()
+        self.muted = MutedRegistry()
+        self.prefixes = PrefixCache(default=config.PREFIX)
+        self.command_metrics = CommandMetrics()
         self.api_keys = {
             'dbl_api_key': config.DBL_API_KEY,
             'server_api_url': config.API_URL,
@@ -58,6 +59,18 @@ class FrogBot(commands.Bot):
             'general_channel': None
         }
         self.sentry_url = config.SENTRY_URL
+        self.startup_report = []
+        self._import_time = 0.0
+        self.deletion_queue = DeletionQueue(flush_interval=config.DELETE_FLUSH_INTERVAL,
+                                            max_batch_size=config.DELETE_BATCH_SIZE)
+        self.dm_categories = DMCategoryCache(max_size=config.DM_CACHE_SIZE,
+                                             flush_interval=config.DM_FLUSH_INTERVAL)
+        self.scheduler = CommandScheduler(self.invoke,
+                                          concurrency=config.COMMAND_CONCURRENCY,
+                                          guild_concurrency=config.GUILD_CONCURRENCY,
+                                          guild_queue_size=config.GUILD_QUEUE_SIZE,
+                                          max_queued=config.MAX_QUEUED_COMMANDS,
+                                          costs=COMMAND_COSTS)
         super(FrogBot, self).__init__(command_prefix, description=desc, **options)
 
     @property
@@ -73,6 +86,52 @@ class FrogBot(commands.Bot):
     def prefix(self):
         return self._prefix
 
+    def load_timed(self, extension: str):
+        """
+        Loads an extension, recording how long the import and the setup took in the startup report.
+        """
+        self._import_time = 0.0
+        start = time.perf_counter()
+        self.load_extension(extension)
+        elapsed = time.perf_counter() - start
+        self.startup_report.append({'cog': extension, 'import': self._import_time,
+                                    'setup': elapsed - self._import_time})
+
+    def _load_from_module_spec(self, spec, key):
+        # Times running the extension's module, load_timed counts the rest of the load as setup
+        exec_module = spec.loader.exec_module
+
+        def timed_exec_module(module):
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                self._import_time = time.perf_counter() - start
+
+        spec.loader.exec_module = timed_exec_module
+        return super()._load_from_module_spec(spec, key)
+
+    def load_lazy_cog(self, command_name) -> bool:
+        """
+        Loads the lazy cog that provides `command_name`, if it is not already loaded.
+
+        :return: True if a cog was loaded.
+        """
+        for extension, command_names in LAZY_COGS.items():
+            if command_name in command_names and extension not in self.extensions:
+                log.info(f'Lazily loading {extension} for {command_name}.')
+                self.load_timed(extension)
+                return True
+        return False
+
+    def could_be_command(self, message) -> bool:
+        """
+        Checks if a message starts with one of the prefixes for its guild, without building a Context.
+        """
+        guild_id = message.guild.id if message.guild else None
+        self.prefixes.count_lookup(guild_id)
+        return message.content.startswith(self.prefixes.matcher(guild_id, self.user.id))
+
     async def update_status_from_db(self):
         current_status = await self.mdb['bot_settings'].find_one({'setting': 'status'})
         if current_status is None:
@@ -83,17 +142,59 @@ class FrogBot(commands.Bot):
         return activity
 
     async def update_muted_from_db(self):
-        muted = []
-        db_muted = self.mdb.muted_clients.find()
-        async for muted_user in db_muted:
-            muted.append(muted_user['_id'])
-        self.muted = muted
-        return muted
+        return await self.muted.load(self.mdb['muted_clients'])
 
     # ---- Overrides ----
+    async def preload(self):
+        """
+        Warms the bot and cog caches from the database.
+        """
+        await self.prefixes.load(self.mdb['prefixes'])
+        await self.update_muted_from_db()
+        for cog in list(self.cogs.values()):
+            preload = getattr(cog, 'preload', None)
+            if preload is not None:
+                await preload()
+
+    async def prepare_database(self):
+        """
+        Creates missing indexes, then checks the hot queries use them when debugging.
+        """
+        await ensure_indexes(self.mdb)
+        if config.DEBUG:
+            await check_query_plans(self.mdb)
+
+    async def start(self, *args, **kwargs):
+        # Warm caches before connecting so no message has to wait on the database
+        await self.preload()
+        self.loop.create_task(self.prepare_database())
+        self.scheduler.start(self.loop)
+        self.deletion_queue.start(self.loop)
+        self.dm_categories.start(self.loop, self.mdb['dmcategories'])
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        self.scheduler.stop()
+        sheets = self.get_cog('SheetApproval')
+        # A failing step must not keep the others, or the gateway connection, from shutting down
+        steps = [('deletion queue', self.deletion_queue.stop), ('DM category cache', self.dm_categories.stop)]
+        if sheets is not None:
+            steps.append(('sheet updates', sheets.flush_updates))
+        for name, step in steps:
+            try:
+                await step()
+            except Exception:
+                log.exception(f'Error while stopping the {name}.')
+        await super().close()
+
     async def get_context(self, message, *, cls=CustomContext):
         return await super().get_context(message, cls=cls)
 
+    async def invoke(self, ctx):
+        # Used by the command metrics in on_command_completion/on_command_error
+        ctx.command_started = time.perf_counter()
+        await super().invoke(ctx)
+
 
 intents = discord.Intents(
     guilds=True, members=True, messages=True, reactions=True,
@@ -130,8 +231,13 @@ async def on_ready():
                     f'Logged in as {bot.user.name} (ID: {bot.user.id})\n' \
                     f'Current Prefix: {config.PREFIX}\n' \
                     f'Loaded {len(bot.muted)} muted users.\n' \
+                    f'Loaded {len(bot.prefixes)} custom prefixes.\n' \
                     f'---------------------------------------------------'
     log.info(ready_message)
+    startup_report = '\n'.join(f'{x["cog"]:<28} import {x["import"] * 1000:8.1f} ms | '
+                                f'setup {x["setup"] * 1000:8.1f} ms' for x in bot.startup_report)
+    total = sum(x['import'] + x['setup'] for x in bot.startup_report)
+    log.info(f'Cog startup report ({total * 1000:.1f} ms total):\n{startup_report}')
 
 
 @tasks.loop(seconds=5, count=1)
@@ -141,10 +247,9 @@ async def db_update():
         for key in ['server_id', 'sheet_channel', 'general_channel']:
             bot.personal_server[key] = result.get(key, None)
 
-    log.info('Updating Status and Muted from DB')
+    log.info('Updating Status from DB')
     new_status = await bot.update_status_from_db()
     await bot.change_presence(activity=new_status)
-    await bot.update_muted_from_db()
 
 
 @db_update.before_loop
@@ -163,9 +268,20 @@ async def on_message(message):
     if message.author.id in bot.muted:
         return
 
+    # Most messages are ordinary chat, skip them before building a Context
+    if not bot.could_be_command(message):
+        return
+
     context = await bot.get_context(message)
+    if context.command is None and message.author.id == bot.owner and config.LAZY_COGS:
+        if bot.load_lazy_cog(context.invoked_with):
+            context = await bot.get_context(message)
     if context.command is not None:
-        return await bot.invoke(context)
+        # Owner commands skip the queue so the bot can still be debugged under load
+        if message.author.id == bot.owner:
+            return await bot.invoke(context)
+        if not bot.scheduler.submit(context) and bot.scheduler.busy_reply_due(context.guild_id):
+            await context.send('FrogBot is busy right now, please try again in a moment.', delete_after=10)
     else:
         if 'CustomCommands' in bot.cogs:
             await bot.cogs['CustomCommands'].run_custom_commands(context)
@@ -176,7 +292,7 @@ async def on_command(ctx):
     if ctx.command.name in ['py', 'pyi', 'sh']:
         return
 
-    await try_delete(ctx.message)
+    bot.deletion_queue.add(ctx.message)
 
 
 @bot.event
@@ -191,6 +307,7 @@ async def on_guild_join(joined):
 @bot.event
 async def on_guild_remove(guild):
     # delete any prefixes
+    bot.prefixes.evict(guild.id)
     try:
         await bot.mdb['prefixes'].delete_one({'guild_id': str(guild.id)})
     except Exception:
@@ -198,11 +315,15 @@ async def on_guild_remove(guild):
 
 
 for cog in COGS:
-    bot.load_extension(cog)
+    bot.load_timed(cog)
+if not config.LAZY_COGS:
+    for cog in LAZY_COGS:
+        bot.load_timed(cog)
 
 if __name__ == '__main__':
 
     if config.SENTRY_URL is not None:
+        import sentry_sdk
         bot.sentry = sentry_sdk.init(config.SENTRY_URL, traces_sample_rate=1)
 
     db_update.start()
@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+
+class RateBudget:
+    def __init__(self, per_minute: float):
+        """
+        Spaces out calls so no more than `per_minute` of them start in any minute.
+
+        :param per_minute: How many calls are allowed per minute, must be more than 0.
+        """
+        if per_minute <= 0:
+            raise ValueError('per_minute must be more than 0.')
+        self.per_minute = per_minute
+        self.interval = 60 / per_minute
+        self._next = time.monotonic()
+        self.used = 0
+
+    async def acquire(self):
+        """
+        Waits until the next call is allowed.
+        """
+        now = time.monotonic()
+        start = max(now, self._next)
+        self._next = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+        self.used += 1
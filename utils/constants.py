@@ -7,6 +7,19 @@ ABLE_TO_KICK = ('bot admin', 'moderator')
 BOT_MODS = ('DM', 'Dragonspeaker', 'Bot Admin')
 DMS = ('DM', 'Trial DM')
 
+# Relative cost of commands for the command scheduler, anything not listed costs 1
+COMMAND_COSTS = {
+    'dm setup': 3,
+    'dm delete': 5,
+    'dm update': 5,
+    'dm addrole-all': 5,
+    'dm removerole-all': 5,
+    'dm archive': 3,
+    'dm unarchive': 3,
+    'invert': 3,
+    'wasted': 3,
+}
+
 STATUS_EMOJIS = {
     'online': '<:online:777327482054901781>',
     'idle': '<:idle:777327273249865758>',
@@ -0,0 +1,89 @@
+import asyncio
+import collections
+import logging
+
+import discord
+
+log = logging.getLogger(__name__)
+
+
+class DeletionQueue:
+    def __init__(self, flush_interval: float = 2.0, max_batch_size: int = 100):
+        """
+        Collects messages to delete per channel and removes them in batches.
+
+        Guild text channels use bulk-delete, which removes up to 100 messages in one request. A batch of one,
+        channels without bulk-delete, or a failed bulk-delete fall back to deleting messages one at a time.
+
+        :param flush_interval: Seconds between flushes.
+        :param max_batch_size: Most messages to delete in one bulk-delete call. Discord allows at most 100.
+        """
+        self.flush_interval = flush_interval
+        self.max_batch_size = max(2, min(max_batch_size, 100))
+        self._pending = collections.OrderedDict()
+        self._task = None
+
+        self.queued = 0
+        self.deleted = 0
+        self.bulk_deleted = 0
+        self.bulk_calls = 0
+        self.single_calls = 0
+
+    def start(self, loop=None):
+        loop = loop or asyncio.get_event_loop()
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def add(self, message):
+        self._pending.setdefault(message.channel.id, (message.channel, []))[1].append(message)
+        self.queued += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('Error while flushing the deletion queue.')
+
+    async def flush(self):
+        pending, self._pending = self._pending, collections.OrderedDict()
+        for channel, messages in pending.values():
+            for start in range(0, len(messages), self.max_batch_size):
+                await self._delete_batch(channel, messages[start:start + self.max_batch_size])
+
+    async def _delete_batch(self, channel, messages):
+        if len(messages) > 1 and isinstance(channel, discord.TextChannel):
+            try:
+                await channel.delete_messages(messages)
+                self.bulk_calls += 1
+                self.bulk_deleted += len(messages)
+                self.deleted += len(messages)
+                return
+            except discord.HTTPException:
+                # Missing permissions, a message too old for bulk-delete or an already deleted message
+                pass
+        for message in messages:
+            self.single_calls += 1
+            try:
+                await message.delete()
+                self.deleted += 1
+            except discord.HTTPException:
+                pass
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'queued': self.queued,
+            'pending': sum(len(messages) for _, messages in self._pending.values()),
+            'deleted': self.deleted,
+            'bulk_calls': self.bulk_calls,
+            'single_calls': self.single_calls,
+            'deletes_saved': self.bulk_deleted - self.bulk_calls
+        }
@@ -0,0 +1,217 @@
+import asyncio
+import collections
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class DMCategoryCache:
+    def __init__(self, max_size: int = 500, flush_interval: float = 10.0):
+        """
+        Write-behind LRU cache of DMCategory objects, keyed by (guild ID, owner ID).
+
+        Commits only mark a category as dirty, dirty categories are written to the database every `flush_interval`
+        seconds and when the bot shuts down. Dirty categories are never evicted, they are written first.
+
+        :param max_size: Most clean categories to keep in memory.
+        :param flush_interval: Seconds between writes of dirty categories.
+        """
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.db = None
+        self._categories = collections.OrderedDict()
+        self._dirty = set()
+        self._task = None
+        # Category channel ID -> (guild ID, owner ID) for every DM category, cached or not
+        self.owners = {}
+        # Category channel IDs of deleted DM categories, commits still in flight for them are ignored
+        self._deleted = set()
+        # Background deletes, referenced here so they can't be garbage collected partway through
+        self._deletes = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.commits = 0
+
+    @staticmethod
+    def key_for(category) -> tuple:
+        return category.guild.id, category.owner.id
+
+    def start(self, loop=None, db=None):
+        """
+        Starts flushing dirty categories in the background.
+
+        :param db: The `dmcategories` collection.
+        """
+        loop = loop or asyncio.get_event_loop()
+        if db is not None:
+            self.db = db
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('Error while flushing DM categories.')
+
+    async def load_owners(self, db):
+        """
+        Loads which DM category each category channel belongs to, used to route channel events.
+
+        :param db: The `dmcategories` collection.
+        """
+        owners = {}
+        async for record in db.find({'deleting': {'$ne': True}},
+                                    {'_id': 0, 'category_id': 1, 'guild_id': 1, 'owner_id': 1}):
+            owners[record['category_id']] = (record['guild_id'], record['owner_id'])
+        self.owners = owners
+        log.info(f'Loaded {len(owners)} DM category owners.')
+        return len(owners)
+
+    def owner_of(self, category_id):
+        return self.owners.get(category_id)
+
+    def get(self, guild_id, owner_id):
+        category = self._categories.get((guild_id, owner_id))
+        if category is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._categories.move_to_end((guild_id, owner_id))
+        return category
+
+    def peek(self, guild_id, owner_id):
+        """
+        Returns a cached category without counting a hit or refreshing its place in the LRU order.
+        """
+        return self._categories.get((guild_id, owner_id))
+
+    def put(self, category):
+        if category.category.id in self._deleted:
+            return
+        key = self.key_for(category)
+        self.owners[category.category.id] = key
+        self._categories[key] = category
+        self._categories.move_to_end(key)
+        self._evict()
+
+    def mark_dirty(self, category):
+        """
+        Queues a category to be written on the next flush.
+        """
+        if category.category.id in self._deleted:
+            return
+        # Mark it dirty first, so putting it in a full cache can't evict it before it is written
+        self._dirty.add(self.key_for(category))
+        self.put(category)
+        self.commits += 1
+
+    def discard(self, category):
+        """
+        Drops a category without writing it, used when it is deleted. Later commits of it are ignored.
+        """
+        self._deleted.add(category.category.id)
+        self.forget(category.category.id)
+
+    def forget(self, category_id: int):
+        """
+        Drops the DM category with this category channel without writing it.
+        """
+        key = self.owners.pop(category_id, None)
+        if key is not None:
+            self._categories.pop(key, None)
+            self._dirty.discard(key)
+
+    def track_delete(self, task):
+        """
+        Keeps a background delete running until it finishes, and logs it if it fails.
+        """
+        self._deletes.add(task)
+        task.add_done_callback(self._delete_done)
+        return task
+
+    def _delete_done(self, task):
+        self._deletes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error('Error while deleting a DM category, it will be retried when the bot restarts.',
+                      exc_info=task.exception())
+
+    def _evict(self):
+        if len(self._categories) <= self.max_size:
+            return
+        for key in list(self._categories):
+            if len(self._categories) <= self.max_size:
+                break
+            if key not in self._dirty:
+                del self._categories[key]
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        remaining = list(dirty)
+        try:
+            while remaining:
+                category = self._categories.get(remaining[-1])
+                if category is not None:
+                    await self._write(category)
+                remaining.pop()
+        finally:
+            # A failed flush keeps the categories it did not write dirty, so they are retried and never evicted
+            self._dirty.update(remaining)
+
+    async def _write(self, category):
+        # No upsert, documents are only created by DMCategory.new, so a category being deleted is never written back
+        await self.db.update_one({'owner_id': category.owner.id, 'guild_id': category.guild.id,
+                                  'deleting': {'$ne': True}}, {'$set': category.to_dict()})
+        self.writes += 1
+
+    async def invalidate(self, predicate) -> int:
+        """
+        Drops every cached category that `predicate` returns True for, writing dirty ones first.
+
+        :return: How many categories were dropped.
+        """
+        keys = [key for key, category in self._categories.items() if predicate(category)]
+        for key in keys:
+            category = self._categories.pop(key)
+            if key in self._dirty:
+                self._dirty.discard(key)
+                await self._write(category)
+        return len(keys)
+
+    async def invalidate_role(self, role) -> int:
+        """
+        Drops the categories in a role's guild that have stored permissions for a deleted role.
+        """
+        def uses_role(category):
+            return category.guild.id == role.guild.id and any(
+                channel.get_permission(role.id) is not None for channel in category.channels
+            )
+
+        return await self.invalidate(uses_role)
+
+    @property
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._categories),
+            'dirty': len(self._dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total) if total else 0.0,
+            'commits': self.commits,
+            'writes': self.writes,
+            'deleting': len(self._deletes)
+        }
+
+    def __len__(self):
+        return len(self._categories)
@@ -0,0 +1,86 @@
+import logging
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+log = logging.getLogger(__name__)
+
+# Collection -> indexes the bot's lookups rely on
+REQUIRED_INDEXES = {
+    'prefixes': [IndexModel([('guild_id', ASCENDING)], name='guild_id')],
+    'custom_commands': [IndexModel([('guild_id', ASCENDING), ('name', ASCENDING)], name='guild_id_name')],
+    'dmcategories': [
+        IndexModel([('owner_id', ASCENDING), ('guild_id', ASCENDING)], name='owner_id_guild_id'),
+        IndexModel([('category_id', ASCENDING)], name='category_id')
+    ],
+    'to_approve': [IndexModel([('message_id', ASCENDING)], name='message_id')],
+    'bot_settings': [IndexModel([('setting', ASCENDING)], name='setting')],
+    # Lets Mongo remove timed mutes once they expire, mutes without an expiry are kept
+    'muted_clients': [IndexModel([('expires_at', ASCENDING)], name='expires_at', expireAfterSeconds=0)],
+}
+
+# Collection, filter for the queries that run on every command or event
+HOT_QUERIES = (
+    ('prefixes', {'guild_id': '0'}),
+    ('custom_commands', {'guild_id': 0, 'name': ''}),
+    ('dmcategories', {'owner_id': 0, 'guild_id': 0}),
+    ('dmcategories', {'category_id': 0}),
+    ('to_approve', {'message_id': 0}),
+    ('bot_settings', {'setting': 'status'}),
+)
+
+
+def _key(index) -> tuple:
+    return tuple((field, direction) for field, direction in index)
+
+
+async def ensure_indexes(db) -> list:
+    """
+    Creates any of the required indexes that do not exist yet.
+
+    An index counts as existing if any index has the same keys, whatever it is named, so indexes created by hand
+    under pymongo's default names are not created a second time.
+
+    :param db: The bot's database.
+    :return: The names of the indexes that were created.
+    """
+    created = []
+    for collection, indexes in REQUIRED_INDEXES.items():
+        try:
+            existing = {_key(info['key']) for info in (await db[collection].index_information()).values()}
+            missing = [index for index in indexes if _key(index.document['key'].items()) not in existing]
+            if missing:
+                created.extend(await db[collection].create_indexes(missing))
+        except PyMongoError:
+            log.exception(f'Could not create indexes for {collection}.')
+    if created:
+        log.info(f'Created {len(created)} missing indexes: {", ".join(created)}')
+    return created
+
+
+def _stages(plan: dict):
+    yield plan.get('stage')
+    if 'inputStage' in plan:
+        yield from _stages(plan['inputStage'])
+    for stage in plan.get('inputStages', []):
+        yield from _stages(stage)
+
+
+async def check_query_plans(db) -> list:
+    """
+    Explains each hot query and warns about any that scan a whole collection.
+
+    :param db: The bot's database.
+    :return: The (collection, filter) of each query that does a collection scan.
+    """
+    scans = []
+    for collection, query in HOT_QUERIES:
+        try:
+            explained = await db[collection].find(query).explain()
+        except PyMongoError:
+            log.exception(f'Could not explain query on {collection}.')
+            continue
+        if 'COLLSCAN' in _stages(explained['queryPlanner']['winningPlan']):
+            log.warning(f'Query on {collection} with keys {", ".join(query)} does a collection scan.')
+            scans.append((collection, query))
+    return scans
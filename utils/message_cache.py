@@ -0,0 +1,63 @@
+import collections
+
+
+class MessageCache:
+    def __init__(self, max_size: int = 200):
+        """
+        Bounded LRU cache of messages the bot sent or edited, so they can be edited again without fetching them.
+
+        discord.py updates a Message in place when the bot edits it, so cached messages stay current for the bot's own
+        changes.
+
+        :param max_size: Most messages to keep.
+        """
+        self.max_size = max_size
+        self._messages = collections.OrderedDict()
+        self.hits = 0
+        self.gateway_hits = 0
+        self.fetches = 0
+
+    def put(self, message):
+        self._messages[message.id] = message
+        self._messages.move_to_end(message.id)
+        while len(self._messages) > self.max_size:
+            self._messages.popitem(last=False)
+
+    def discard(self, message_id):
+        self._messages.pop(message_id, None)
+
+    async def fetch(self, channel, message_id, state=None):
+        """
+        Gets a message from this cache, then the gateway's message cache, and only then from the API.
+
+        :param channel: The channel the message is in.
+        :param message_id: The ID of the message.
+        :param state: The bot's connection state (`bot._connection`), to check its message cache.
+        """
+        message = self._messages.get(message_id)
+        if message is not None:
+            self.hits += 1
+            self._messages.move_to_end(message_id)
+            return message
+        message = state._get_message(message_id) if state is not None else None
+        if message is not None:
+            self.gateway_hits += 1
+        else:
+            message = await channel.fetch_message(message_id)
+            self.fetches += 1
+        self.put(message)
+        return message
+
+    @property
+    def stats(self) -> dict:
+        total = self.hits + self.gateway_hits + self.fetches
+        return {
+            'size': len(self._messages),
+            'hits': self.hits,
+            'gateway_hits': self.gateway_hits,
+            'fetches': self.fetches,
+            'hit_rate': ((self.hits + self.gateway_hits) / total) if total else 0.0
+        }
+
+    def __len__(self):
+        return len(self._messages)
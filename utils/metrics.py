@@ -0,0 +1,94 @@
+import bisect
+
+# Bucket upper bounds in seconds, growing by 25% from 1 ms to roughly 2 minutes
+LATENCY_BUCKETS = tuple(0.001 * (1.25 ** i) for i in range(53))
+
+
+class LatencyHistogram:
+    def __init__(self):
+        """
+        Fixed-memory latency histogram using log-scaled buckets.
+
+        Percentiles are accurate to the width of a bucket, about 25%.
+        """
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = percent / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index >= len(LATENCY_BUCKETS):
+                    return self.max
+                return min(LATENCY_BUCKETS[index], self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return (self.total / self.count) if self.count else 0.0
+
+
+class CommandStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.invocations = 0
+        self.errors = 0
+
+    def record(self, seconds: float, failed: bool = False):
+        self.latency.record(seconds)
+        self.invocations += 1
+        if failed:
+            self.errors += 1
+
+    @property
+    def error_rate(self) -> float:
+        return (self.errors / self.invocations) if self.invocations else 0.0
+
+    def to_dict(self):
+        return {
+            'invocations': self.invocations,
+            'errors': self.errors,
+            'error_rate': self.error_rate,
+            'mean': self.latency.mean,
+            'p50': self.latency.percentile(50),
+            'p95': self.latency.percentile(95),
+            'p99': self.latency.percentile(99),
+            'max': self.latency.max
+        }
+
+
+class CommandMetrics:
+    def __init__(self):
+        """
+        Latency and error counts for each command, keyed by qualified name.
+        """
+        self.commands = {}
+
+    def record(self, name: str, seconds: float, failed: bool = False):
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        stats.record(seconds, failed)
+
+    def slowest(self, limit: int = 5, percentile: int = 95):
+        """
+        Returns (name, stats) pairs for the slowest commands at the given percentile.
+        """
+        ranked = sorted(self.commands.items(), key=lambda item: item[1].latency.percentile(percentile), reverse=True)
+        return ranked[:limit]
+
+    def to_dict(self):
+        return {name: stats.to_dict() for name, stats in sorted(self.commands.items())}
@@ -0,0 +1,65 @@
+import datetime
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class MutedRegistry:
+    def __init__(self):
+        """
+        In-memory copy of the `muted_clients` collection.
+
+        Membership checks are a set lookup. Temporary mutes also have an entry in `_expiry`, and are dropped the
+        first time they are checked after they expire.
+        """
+        self._muted = set()
+        self._expiry = {}
+
+    async def load(self, db):
+        """
+        Loads every active mute from the database, removing any expired temporary mutes.
+
+        :param db: The `muted_clients` collection.
+        """
+        now = datetime.datetime.utcnow()
+        muted, expiry = set(), {}
+        async for record in db.find():
+            expires_at = record.get('expires_at')
+            if expires_at is not None and expires_at <= now:
+                continue
+            muted.add(record['_id'])
+            if expires_at is not None:
+                expiry[record['_id']] = expires_at
+        await db.delete_many({'expires_at': {'$lte': now}})
+        self._muted, self._expiry = muted, expiry
+        log.info(f'Loaded {len(muted)} muted users.')
+        return muted
+
+    def add(self, user_id: int, expires_at: datetime.datetime = None):
+        self._muted.add(user_id)
+        if expires_at is not None:
+            self._expiry[user_id] = expires_at
+        else:
+            self._expiry.pop(user_id, None)
+
+    def remove(self, user_id: int) -> bool:
+        self._expiry.pop(user_id, None)
+        if user_id in self._muted:
+            self._muted.remove(user_id)
+            return True
+        return False
+
+    def __contains__(self, user_id):
+        if user_id not in self._muted:
+            return False
+        expires_at = self._expiry.get(user_id)
+        if expires_at is not None and expires_at <= datetime.datetime.utcnow():
+            self.remove(user_id)
+            return False
+        return True
+
+    def __len__(self):
+        return len(self._muted)
+
+    def __iter__(self):
+        return iter(self._muted)
@@ -0,0 +1,88 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class PrefixCache:
+    def __init__(self, default: str):
+        """
+        In-memory copy of the `prefixes` collection, keyed by guild ID (as a string).
+
+        Only guilds with a custom prefix are stored, every other guild uses the default prefix. The whole
+        collection is loaded once at startup, so looking up a prefix never has to wait on the database.
+
+        :param default: Prefix to use for guilds without a custom prefix.
+        """
+        self.default = default
+        self._prefixes = {}
+        # prefix -> every string a command message could start with
+        self._matchers = {}
+        self._user_id = None
+        # Messages checked for a command, by whether their guild has a custom prefix
+        self.custom_lookups = 0
+        self.default_lookups = 0
+
+    async def load(self, db):
+        """
+        Loads every custom prefix from the database in one cursor.
+
+        :param db: The `prefixes` collection.
+        """
+        prefixes = {}
+        async for record in db.find({}, {'_id': 0, 'guild_id': 1, 'prefix': 1}):
+            if record.get('prefix') is not None:
+                prefixes[str(record['guild_id'])] = record['prefix']
+        self._prefixes = prefixes
+        log.info(f'Loaded {len(prefixes)} custom prefixes.')
+        return len(prefixes)
+
+    def get(self, guild_id) -> str:
+        return self._prefixes.get(str(guild_id), self.default)
+
+    def count_lookup(self, guild_id):
+        """
+        Records that a message from this guild was checked for a command prefix.
+        """
+        if guild_id is not None and str(guild_id) in self._prefixes:
+            self.custom_lookups += 1
+        else:
+            self.default_lookups += 1
+
+    def matcher(self, guild_id, user_id: int) -> tuple:
+        """
+        Returns every string that a command message in this guild could start with, in the same order as
+        `commands.when_mentioned_or`. The result can be passed straight to `str.startswith`.
+
+        :param guild_id: The ID of the guild, or None for direct messages.
+        :param user_id: The ID of the bot user, used for the mention prefixes.
+        """
+        prefix = self.get(guild_id) if guild_id is not None else self.default
+        if user_id != self._user_id:
+            self._matchers.clear()
+            self._user_id = user_id
+        matcher = self._matchers.get(prefix)
+        if matcher is None:
+            matcher = self._matchers[prefix] = (f'<@{user_id}> ', f'<@!{user_id}> ', prefix)
+        return matcher
+
+    def set(self, guild_id, prefix: str):
+        self._prefixes[str(guild_id)] = prefix
+
+    def evict(self, guild_id):
+        return self._prefixes.pop(str(guild_id), None)
+
+    @property
+    def stats(self) -> dict:
+        total = self.custom_lookups + self.default_lookups
+        return {
+            'size': len(self._prefixes),
+            'custom_lookups': self.custom_lookups,
+            'default_lookups': self.default_lookups,
+            'custom_rate': (self.custom_lookups / total) if total else 0.0
+        }
+
+    def __contains__(self, guild_id):
+        return str(guild_id) in self._prefixes
+
+    def __len__(self):
+        return len(self._prefixes)
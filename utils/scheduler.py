@@ -0,0 +1,163 @@
+import asyncio
+import collections
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class CommandScheduler:
+    def __init__(self, invoke, concurrency: int = 16, guild_concurrency: int = 4, guild_queue_size: int = 10,
+                 max_queued: int = 200, costs: dict = None, busy_reply_interval: float = 10.0):
+        """
+        Sits between `on_message` and `Bot.invoke`, queueing commands per guild.
+
+        Guilds are served with deficit round robin, so a guild queueing many (or expensive) commands only gets its
+        fair share of the worker pool. A guild can also only run `guild_concurrency` commands at once, so commands
+        that wait on users (such as confirmation prompts) can't hold every worker. When a guild's queue or the global
+        queue is full, new commands are shed.
+
+        :param invoke: Coroutine function that runs a Context, usually `Bot.invoke`.
+        :param concurrency: Number of commands that can run at once.
+        :param guild_concurrency: Number of commands one guild can run at once.
+        :param guild_queue_size: Maximum number of commands waiting per guild.
+        :param max_queued: Maximum number of commands waiting across all guilds.
+        :param costs: Qualified command name -> cost. Commands not listed cost 1.
+        :param busy_reply_interval: Minimum number of seconds between "busy" replies in one guild.
+        """
+        self.invoke = invoke
+        self.concurrency = concurrency
+        self.guild_concurrency = max(1, guild_concurrency)
+        self.guild_queue_size = guild_queue_size
+        self.max_queued = max_queued
+        self.costs = costs or {}
+        self.busy_reply_interval = busy_reply_interval
+
+        self._queues = {}
+        self._deficits = {}
+        self._active = collections.deque()
+        # Guild -> number of its commands running
+        self._running = {}
+        self._wakeup = asyncio.Event()
+        self._workers = []
+        self._last_busy_reply = {}
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.shed = 0
+        self._waits = collections.deque(maxlen=500)
+
+    def start(self, loop=None):
+        loop = loop or asyncio.get_event_loop()
+        if self._workers:
+            return
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def cost_of(self, ctx) -> int:
+        return self.costs.get(ctx.command.qualified_name, 1)
+
+    def submit(self, ctx) -> bool:
+        """
+        Queues a Context to be invoked.
+
+        :return: False if the command was shed because the queues are full.
+        """
+        key = ctx.guild_id
+        queue = self._queues.get(key)
+        if self.queued >= self.max_queued or (queue is not None and len(queue) >= self.guild_queue_size):
+            self.shed += 1
+            return False
+        if queue is None:
+            queue = self._queues[key] = collections.deque()
+            self._deficits[key] = 0
+            self._active.append(key)
+        queue.append((ctx, time.monotonic(), self.cost_of(ctx)))
+        self.queued += 1
+        self._wakeup.set()
+        return True
+
+    def busy_reply_due(self, key) -> bool:
+        """
+        Checks if a guild should be told that its command was shed, so a spamming guild only gets one reply.
+        """
+        now = time.monotonic()
+        if now - self._last_busy_reply.get(key, 0) < self.busy_reply_interval:
+            return False
+        self._last_busy_reply[key] = now
+        return True
+
+    def _runnable(self, key) -> bool:
+        return self._running.get(key, 0) < self.guild_concurrency
+
+    def _next(self):
+        """
+        Takes the next command to run, or None if every guild with queued commands is at its concurrency limit.
+        """
+        if not any(self._runnable(key) for key in self._active):
+            return None
+        while True:
+            key = self._active[0]
+            if not self._runnable(key):
+                # Guilds at their limit don't build up deficit while they wait
+                self._active.rotate(-1)
+                continue
+            queue = self._queues[key]
+            ctx, enqueued, cost = queue[0]
+            if self._deficits[key] >= cost:
+                queue.popleft()
+                self._deficits[key] -= cost
+                if not queue:
+                    self._active.popleft()
+                    self._queues.pop(key)
+                    self._deficits.pop(key)
+                self.queued -= 1
+                self._running[key] = self._running.get(key, 0) + 1
+                return key, ctx, enqueued
+            self._deficits[key] += 1
+            self._active.rotate(-1)
+
+    async def _worker(self):
+        while True:
+            job = self._next()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            key, ctx, enqueued = job
+            self._waits.append(time.monotonic() - enqueued)
+            self.running += 1
+            try:
+                await self.invoke(ctx)
+            except Exception:
+                log.exception(f'Error while invoking {ctx.command.qualified_name}')
+            finally:
+                self.running -= 1
+                self.completed += 1
+                self._running[key] -= 1
+                if not self._running[key]:
+                    del self._running[key]
+                # Another command from this guild may be able to run now
+                self._wakeup.set()
+
+    @property
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        depths = sorted(self._queues.items(), key=lambda item: len(item[1]), reverse=True)
+        return {
+            'queued': self.queued,
+            'running': self.running,
+            'concurrency': self.concurrency,
+            'guild_concurrency': self.guild_concurrency,
+            'completed': self.completed,
+            'shed': self.shed,
+            'avg_wait': (sum(waits) / len(waits)) if waits else 0.0,
+            'p95_wait': waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            'max_wait': waits[-1] if waits else 0.0,
+            'deepest_guilds': [{'guild_id': key, 'depth': len(queue)} for key, queue in depths[:3]]
+        }